@@ -0,0 +1,163 @@
+from sqlalchemy import func, case, delete
+from models import db, User, Doctor, Department, Appointment, Treatment, AppointmentRollup, RollupWatermark
+from datetime import datetime, timedelta
+
+ROLLUP_NAME = 'appointment_rollup'
+
+BUCKETS = ('day', 'week', 'month')
+GROUPS = ('none', 'department', 'doctor')
+
+# Re-scan this far behind the watermark so rows committed while a refresh ran are not missed
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+# Days recomputed per aggregate query (keeps IN lists under SQLite's variable limit)
+REFRESH_DAYS_PER_QUERY = 200
+
+
+def bucket_start(day, bucket):
+    """First day of the day/week (Monday)/month bucket containing day"""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _changed_days(since):
+    """Appointment dates touched by an appointment or treatment change after since"""
+    appointment_days = db.session.query(Appointment.appointment_date).filter(
+        Appointment.updated_at > since
+    ).distinct()
+    treatment_days = db.session.query(Appointment.appointment_date).join(
+        Treatment, Treatment.appointment_id == Appointment.id
+    ).filter(Treatment.updated_at > since).distinct()
+
+    return {day for (day,) in appointment_days} | {day for (day,) in treatment_days}
+
+
+def _aggregate(days=None):
+    """Rollup rows for the given appointment dates (all dates when None), one grouped query"""
+    query = db.session.query(
+        Appointment.appointment_date,
+        Appointment.doctor_id,
+        Doctor.department_id,
+        func.count(Appointment.id),
+        func.sum(case((Appointment.status == 'Booked', 1), else_=0)),
+        func.sum(case((Appointment.status == 'Completed', 1), else_=0)),
+        func.sum(case((Appointment.status == 'Cancelled', 1), else_=0)),
+        func.sum(case((Treatment.follow_up_required == True, 1), else_=0))
+    ).join(
+        Doctor, Doctor.id == Appointment.doctor_id
+    ).outerjoin(
+        Treatment, Treatment.appointment_id == Appointment.id
+    ).group_by(
+        Appointment.appointment_date, Appointment.doctor_id, Doctor.department_id
+    )
+
+    if days is not None:
+        query = query.filter(Appointment.appointment_date.in_(days))
+
+    return [
+        {
+            'day': day,
+            'doctor_id': doctor_id,
+            'department_id': department_id,
+            'total': total,
+            'booked': booked or 0,
+            'completed': completed or 0,
+            'cancelled': cancelled or 0,
+            'follow_ups': follow_ups or 0
+        }
+        for day, doctor_id, department_id, total, booked, completed, cancelled, follow_ups in query
+    ]
+
+
+def refresh_rollups(full=False):
+    """Recompute rollup rows for days changed since the last refresh (every day when full); returns days refreshed"""
+    started = datetime.utcnow()
+    watermark = RollupWatermark.query.filter_by(name=ROLLUP_NAME).first()
+
+    if full or watermark is None:
+        db.session.execute(delete(AppointmentRollup))
+        rows = _aggregate()
+        refreshed = len({row['day'] for row in rows})
+    else:
+        days = sorted(_changed_days(watermark.refreshed_through - REFRESH_OVERLAP))
+        rows = []
+        for i in range(0, len(days), REFRESH_DAYS_PER_QUERY):
+            chunk = days[i:i + REFRESH_DAYS_PER_QUERY]
+            db.session.execute(delete(AppointmentRollup).where(AppointmentRollup.day.in_(chunk)))
+            rows += _aggregate(chunk)
+        refreshed = len(days)
+
+    if rows:
+        db.session.execute(AppointmentRollup.__table__.insert(), rows)
+
+    if watermark is None:
+        watermark = RollupWatermark(name=ROLLUP_NAME, refreshed_through=started)
+        db.session.add(watermark)
+    else:
+        watermark.refreshed_through = started
+
+    db.session.commit()
+    return refreshed
+
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else 0.0
+
+
+def query_analytics(start_date, end_date, bucket='day', group_by='none'):
+    """Appointment volume and outcome rates per bucket (and department/doctor) from the rollup table"""
+    rows = db.session.query(
+        AppointmentRollup.day,
+        AppointmentRollup.department_id,
+        AppointmentRollup.doctor_id,
+        AppointmentRollup.total,
+        AppointmentRollup.completed,
+        AppointmentRollup.cancelled,
+        AppointmentRollup.follow_ups
+    ).filter(
+        AppointmentRollup.day >= start_date,
+        AppointmentRollup.day <= end_date
+    )
+
+    series = {}
+    for day, department_id, doctor_id, total, completed, cancelled, follow_ups in rows:
+        group = {'department': department_id, 'doctor': doctor_id}.get(group_by)
+        key = (bucket_start(day, bucket), group)
+        totals = series.setdefault(key, [0, 0, 0, 0])
+        totals[0] += total
+        totals[1] += completed
+        totals[2] += cancelled
+        totals[3] += follow_ups
+
+    names = {}
+    group_ids = {group for _, group in series}
+    if group_by == 'department' and group_ids:
+        names = dict(db.session.query(Department.id, Department.name).filter(Department.id.in_(group_ids)))
+    elif group_by == 'doctor' and group_ids:
+        names = dict(db.session.query(Doctor.id, User.full_name).join(
+            User, User.id == Doctor.user_id
+        ).filter(Doctor.id.in_(group_ids)))
+
+    result = []
+    for (period, group), (total, completed, cancelled, follow_ups) in sorted(
+        series.items(), key=lambda item: (item[0][0], item[0][1] or 0)
+    ):
+        entry = {'period': period.strftime('%Y-%m-%d')}
+        if group_by != 'none':
+            entry[f'{group_by}_id'] = group
+            entry[group_by] = names.get(group)
+        entry.update({
+            'appointments': total,
+            'completed': completed,
+            'cancelled': cancelled,
+            'follow_ups': follow_ups,
+            'completion_rate': _rate(completed, total),
+            'cancellation_rate': _rate(cancelled, total),
+            'follow_up_rate': _rate(follow_ups, completed)
+        })
+        result.append(entry)
+
+    return result
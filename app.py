@@ -1,37 +1,92 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from flask_security import Security, SQLAlchemyUserDatastore, auth_required, roles_required, roles_accepted, current_user, hash_password
-from flask_caching import Cache
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context
+from flask_security import Security, SQLAlchemyUserDatastore, auth_required, roles_required, roles_accepted, current_user, hash_password, verify_password
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash
-from models import db, User, Roles, Doctor, Patient, Department, Appointment, Treatment, DoctorAvailability, user_roles
+from models import db, User, Roles, Doctor, Patient, Department, Appointment, Treatment, DoctorAvailability, user_roles, ensure_indexes
+from scheduling import get_slot_occupancy, find_open_slots, reserve_slot, release_slot
+from search import ensure_search_index, search_index_available, search_profile_ids
+from exports import SYNC_EXPORT_MAX_ROWS, count_treatment_history, iter_treatment_csv, find_cached_export
+from stats import apply_counters, booking_deltas, status_change_deltas, get_counters, ensure_counters, PATIENTS, ACTIVE_DOCTORS, APPOINTMENTS, appointments_on
+from analytics import BUCKETS, GROUPS, query_analytics
+from metrics import init_metrics, render_metrics
+from task_metrics import init_task_metrics, get_task_metrics, get_run_metrics
+from caching import cache, cached_view, bump, user_entity, get_identity, invalidate_identity
+from queries import appointment_query, doctor_query, patient_query, serialize_appointments, serialize_doctors, serialize_patients, keyset_page, ndjson_response
+from sqlalchemy import func, case
+from sqlalchemy.orm import joinedload
 from datetime import datetime, date, time, timedelta
 from celery import Celery
-from celery.schedules import crontab
+from celery.schedules import crontab, maybe_schedule, schedule as interval_schedule
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
 import os
 
 # Flask App Configuration
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'this-is-a-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital_management.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Database: DATABASE_URL selects the backend (defaults to local SQLite)
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///hospital_management.db')
+# Bare postgres:// / postgresql:// URLs use psycopg2 (SQLAlchemy 2.1 would otherwise pick psycopg 3)
+for scheme in ('postgres://', 'postgresql://'):
+    if DATABASE_URL.startswith(scheme):
+        DATABASE_URL = DATABASE_URL.replace(scheme, 'postgresql+psycopg2://', 1)
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+
+if DATABASE_URL.startswith('sqlite'):
+    # WAL mode and synchronous level are set per connection in models.py
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'connect_args': {'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))}
+    }
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
+
 app.config['SECURITY_PASSWORD_SALT'] = 'this-is-a-password-salt'
-app.config['SECURITY_PASSWORD_HASH'] = 'bcrypt'
 app.config['WTF_CSRF_ENABLED'] = False
 app.config['SECURITY_TOKEN_AUTHENTICATION_HEADER'] = 'Authentication-Token'
 app.config['SECURITY_TOKEN_MAX_AGE'] = 86400  # 24 hours
+# Join roles into the token user lookup only, so roles_required costs no extra query
+app.config['SECURITY_JOIN_USER_ROLES'] = True
+
+# Password hashing: PASSWORD_HASH picks the scheme for new hashes; hashes in any other
+# scheme or with a different cost are transparently rehashed on the next successful login
+app.config['SECURITY_PASSWORD_HASH'] = os.environ.get('PASSWORD_HASH', 'bcrypt')
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+app.config['SECURITY_PASSWORD_HASH_PASSLIB_OPTIONS'] = {
+    'bcrypt__default_rounds': BCRYPT_ROUNDS,
+    'bcrypt__min_rounds': BCRYPT_ROUNDS,
+    'bcrypt__max_rounds': BCRYPT_ROUNDS,
+    'argon2__time_cost': int(os.environ.get('ARGON2_TIME_COST', 2)),
+    'argon2__memory_cost': int(os.environ.get('ARGON2_MEMORY_COST', 19456)),  # KiB
+    'argon2__parallelism': int(os.environ.get('ARGON2_PARALLELISM', 1))
+}
 
 # Flask-Caching with Redis
-app.config['CACHE_TYPE'] = 'RedisCache'
+app.config['CACHE_TYPE'] = os.environ.get('CACHE_TYPE', 'RedisCache')
 app.config['CACHE_REDIS_HOST'] = 'localhost'
 app.config['CACHE_REDIS_PORT'] = 6379
 app.config['CACHE_REDIS_DB'] = 2
 app.config['CACHE_DEFAULT_TIMEOUT'] = 300
 
+# Per-request latency/SQL/cache instrumentation, off unless METRICS_ENABLED is set
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+
 # Initialize extensions
 db.init_app(app)
-cache = Cache(app)
+cache.init_app(app)
 CORS(app)
 
+if app.config['METRICS_ENABLED']:
+    init_metrics(app)
+
 # Flask-Security
 user_datastore = SQLAlchemyUserDatastore(db, User, Roles)
 security = Security(app, user_datastore)
@@ -52,17 +107,23 @@ def celery_init_app(app):
     return celery_app
 
 celery = celery_init_app(app)
+init_task_metrics(app)
 
 # Import tasks after celery initialization (tasks will be auto-discovered)
 try:
-    from tasks import send_daily_reminders, send_monthly_reports, export_treatment_csv
+    from task import send_daily_reminders, send_monthly_reports, export_treatment_csv
 except ImportError:
     pass  # Tasks will be imported when needed
 
 
 # ============= DATABASE INITIALIZATION =============
-with app.app_context():
+# Schema creation and seeding run from `flask --app app init-db` (once per deploy),
+# so importing this module in web and Celery workers never touches the database.
+def init_db():
+    """Create tables and indexes, then seed roles, the admin user and departments"""
     db.create_all()
+    ensure_indexes(db.engine)
+    ensure_search_index(db.engine)
     
     # Create roles
     if not user_datastore.find_role('admin'):
@@ -102,6 +163,81 @@ with app.app_context():
             db.session.add(dept)
     
     db.session.commit()
+    
+    ensure_counters()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the schema and seed reference data"""
+    init_db()
+    print('Database initialized')
+
+
+# ============= LOGIN HELPERS =============
+# Password hashing is CPU-bound; a bounded pool caps concurrent hashes per worker during login storms
+LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', 4))
+login_executor = ThreadPoolExecutor(max_workers=LOGIN_HASH_WORKERS, thread_name_prefix='login-hash')
+
+# Recently failed credentials are rejected without hashing again
+LOGIN_FAILURE_TTL = 60
+
+
+def check_password(password, password_hash):
+    """Verify a password and compute a replacement hash if the stored one is outdated"""
+    with app.app_context():
+        if not verify_password(password, password_hash):
+            return False, None
+        if security.pwd_context.needs_update(password_hash):
+            return True, hash_password(password)
+        return True, None
+
+
+def login_failure_key(email, password, password_hash):
+    """Cache key for a failed attempt; tied to the stored hash so a password change clears it"""
+    digest = hmac.new(
+        app.config['SECRET_KEY'].encode(),
+        f'{email}\0{password}\0{password_hash}'.encode(),
+        hashlib.sha256
+    ).hexdigest()
+    return f'login_failure:{digest}'
+
+
+# ============= AUTH IDENTITY =============
+def load_identity(user_id):
+    """Doctor/patient profile ids for a user"""
+    return {
+        'doctor_id': db.session.query(Doctor.id).filter(Doctor.user_id == user_id).scalar(),
+        'patient_id': db.session.query(Patient.id).filter(Patient.user_id == user_id).scalar()
+    }
+
+
+def current_doctor_id():
+    """Doctor profile id of the authenticated user, without a query on cache hits"""
+    return get_identity(current_user.id, load_identity)['doctor_id']
+
+
+def current_patient_id():
+    """Patient profile id of the authenticated user, without a query on cache hits"""
+    return get_identity(current_user.id, load_identity)['patient_id']
+
+
+# ============= CACHE INVALIDATION =============
+def bump_appointment_caches(appointment):
+    """Invalidate global appointment views plus both participants' dashboards"""
+    bump(
+        'appointment',
+        user_entity(appointment.doctor.user_id),
+        user_entity(appointment.patient.user_id)
+    )
+
+
+def bump_patient_doctor_caches(patient_id):
+    """Invalidate the dashboards of every doctor the patient has appointments with"""
+    doctor_user_ids = db.session.query(Doctor.user_id).join(
+        Appointment, Appointment.doctor_id == Doctor.id
+    ).filter(Appointment.patient_id == patient_id).distinct().all()
+    bump(*[user_entity(user_id) for (user_id,) in doctor_user_ids])
 
 
 # ============= PUBLIC ROUTES =============
@@ -148,8 +284,11 @@ def register():
         # Create patient profile
         patient = Patient(user_id=user.id)
         db.session.add(patient)
+        apply_counters({PATIENTS: 1})
         db.session.commit()
         
+        bump('patient')
+        
         return jsonify({
             'message': 'Registration successful',
             'user_id': user.id
@@ -168,9 +307,23 @@ def login():
         
         user = User.query.filter_by(email=data['email']).first()
         
-        if not user or not user.verify_password(data['password']):
+        if not user:
+            return jsonify({'error': 'Invalid credentials'}), 401
+        
+        failure_key = login_failure_key(data['email'], data['password'], user.password)
+        if cache.get(failure_key):
+            return jsonify({'error': 'Invalid credentials'}), 401
+        
+        verified, new_hash = login_executor.submit(check_password, data['password'], user.password).result()
+        
+        if not verified:
+            cache.set(failure_key, True, timeout=LOGIN_FAILURE_TTL)
             return jsonify({'error': 'Invalid credentials'}), 401
         
+        if new_hash:
+            user.password = new_hash
+            db.session.commit()
+        
         if not user.active:
             return jsonify({'error': 'Account deactivated'}), 403
         
@@ -199,36 +352,27 @@ def login():
 @app.route('/api/admin/dashboard', methods=['GET'])
 @auth_required('token')
 @roles_required('admin')
-@cache.cached(timeout=60, key_prefix='admin_dashboard')
+@cached_view(timeout=300, depends_on=('doctor', 'patient', 'appointment'), key_prefix='admin_dashboard')
 def admin_dashboard():
     """Admin dashboard statistics"""
     try:
-        total_doctors = Doctor.query.filter_by(is_active=True).count()
-        total_patients = Patient.query.count()
-        total_appointments = Appointment.query.count()
+        # Counters are maintained by the write paths, so this is one indexed lookup
+        today_key = appointments_on(date.today())
+        counters = get_counters(ACTIVE_DOCTORS, PATIENTS, APPOINTMENTS, today_key)
         
-        today = date.today()
-        today_appointments = Appointment.query.filter_by(appointment_date=today).count()
-        
-        # Recent appointments
-        recent_appointments = Appointment.query.order_by(Appointment.created_at.desc()).limit(10).all()
-        
-        appointments_data = []
-        for apt in recent_appointments:
-            appointments_data.append({
-                'id': apt.id,
-                'patient_name': apt.patient.user.full_name,
-                'doctor_name': apt.doctor.user.full_name,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'time': apt.appointment_time.strftime('%H:%M'),
-                'status': apt.status
-            })
+        # Recent appointments (ids increase with creation time, so the primary key orders them)
+        recent_appointments = appointment_query().order_by(Appointment.id.desc()).limit(10).all()
+        
+        appointments_data = serialize_appointments(
+            recent_appointments,
+            ('id', 'patient_name', 'doctor_name', 'date', 'time', 'status')
+        )
         
         return jsonify({
-            'total_doctors': total_doctors,
-            'total_patients': total_patients,
-            'total_appointments': total_appointments,
-            'today_appointments': today_appointments,
+            'total_doctors': counters[ACTIVE_DOCTORS],
+            'total_patients': counters[PATIENTS],
+            'total_appointments': counters[APPOINTMENTS],
+            'today_appointments': counters[today_key],
             'recent_appointments': appointments_data
         }), 200
         
@@ -242,21 +386,12 @@ def admin_dashboard():
 def admin_get_doctors():
     """Get all doctors"""
     try:
-        doctors = Doctor.query.all()
-        
-        doctors_data = []
-        for doc in doctors:
-            doctors_data.append({
-                'id': doc.id,
-                'user_id': doc.user.id,
-                'name': doc.user.full_name,
-                'email': doc.user.email,
-                'phone': doc.user.phone,
-                'department': doc.department.name,
-                'qualification': doc.qualification,
-                'experience_years': doc.experience_years,
-                'is_active': doc.is_active
-            })
+        doctors = doctor_query().all()
+        
+        doctors_data = serialize_doctors(
+            doctors,
+            ('id', 'user_id', 'name', 'email', 'phone', 'department', 'qualification', 'experience_years', 'is_active')
+        )
         
         return jsonify(doctors_data), 200
         
@@ -299,9 +434,10 @@ def admin_add_doctor():
         )
         
         db.session.add(doctor)
+        apply_counters({ACTIVE_DOCTORS: 1})
         db.session.commit()
         
-        cache.delete('admin_dashboard')
+        bump('doctor')
         
         return jsonify({'message': 'Doctor added successfully', 'doctor_id': doctor.id}), 201
         
@@ -331,7 +467,8 @@ def admin_update_doctor(doctor_id):
         doctor.experience_years = data.get('experience_years', doctor.experience_years)
         
         db.session.commit()
-        cache.delete('admin_dashboard')
+        bump('doctor')
+        invalidate_identity(doctor.user_id)
         
         return jsonify({'message': 'Doctor updated successfully'}), 200
         
@@ -349,9 +486,11 @@ def admin_toggle_doctor(doctor_id):
         doctor = Doctor.query.get_or_404(doctor_id)
         doctor.is_active = not doctor.is_active
         doctor.user.active = doctor.is_active
+        apply_counters({ACTIVE_DOCTORS: 1 if doctor.is_active else -1})
         
         db.session.commit()
-        cache.delete('admin_dashboard')
+        bump('doctor')
+        invalidate_identity(doctor.user_id)
         
         status = 'activated' if doctor.is_active else 'deactivated'
         return jsonify({'message': f'Doctor {status} successfully'}), 200
@@ -365,25 +504,33 @@ def admin_toggle_doctor(doctor_id):
 @auth_required('token')
 @roles_required('admin')
 def admin_get_patients():
-    """Get all patients"""
+    """Get all patients (keyset-paginated with ?limit/&cursor, streamed with ?format=ndjson)"""
     try:
-        patients = Patient.query.all()
+        fields = ('id', 'user_id', 'name', 'email', 'phone', 'blood_group', 'is_active', 'created_at')
+        keyset = (Patient.created_at, Patient.id)
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        
+        if request.args.get('format') == 'ndjson':
+            return ndjson_response(
+                patient_query(), serialize_patients, fields, keyset, cursor, max(1, limit) if limit else None
+            )
         
-        patients_data = []
-        for pat in patients:
-            patients_data.append({
-                'id': pat.id,
-                'user_id': pat.user.id,
-                'name': pat.user.full_name,
-                'email': pat.user.email,
-                'phone': pat.user.phone,
-                'blood_group': pat.user.blood_group,
-                'is_active': pat.user.active,
-                'created_at': pat.created_at.strftime('%Y-%m-%d')
-            })
+        if limit or cursor:
+            patients, next_cursor = keyset_page(patient_query(), keyset, cursor, max(1, min(limit or 50, 500)))
+            return jsonify({
+                'items': serialize_patients(patients, fields),
+                'next_cursor': next_cursor
+            }), 200
+        
+        patients = patient_query().all()
+        
+        patients_data = serialize_patients(patients, fields)
         
         return jsonify(patients_data), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -398,6 +545,8 @@ def admin_toggle_patient(patient_id):
         patient.user.active = not patient.user.active
         
         db.session.commit()
+        bump('patient')
+        invalidate_identity(patient.user_id)
         
         status = 'activated' if patient.user.active else 'deactivated'
         return jsonify({'message': f'Patient {status} successfully'}), 200
@@ -411,27 +560,36 @@ def admin_toggle_patient(patient_id):
 @auth_required('token')
 @roles_required('admin')
 def admin_get_appointments():
-    """Get all appointments"""
+    """Get all appointments (keyset-paginated with ?limit/&cursor, streamed with ?format=ndjson)"""
     try:
-        appointments = Appointment.query.order_by(Appointment.appointment_date.desc()).all()
-        
-        appointments_data = []
-        for apt in appointments:
-            appointments_data.append({
-                'id': apt.id,
-                'patient_name': apt.patient.user.full_name,
-                'patient_id': apt.patient_id,
-                'doctor_name': apt.doctor.user.full_name,
-                'doctor_id': apt.doctor_id,
-                'department': apt.doctor.department.name,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'time': apt.appointment_time.strftime('%H:%M'),
-                'status': apt.status,
-                'reason': apt.reason
-            })
+        fields = ('id', 'patient_name', 'patient_id', 'doctor_name', 'doctor_id', 'department', 'date', 'time', 'status', 'reason')
+        keyset = (Appointment.appointment_date, Appointment.id)
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        
+        if request.args.get('format') == 'ndjson':
+            return ndjson_response(
+                appointment_query(), serialize_appointments, fields, keyset, cursor,
+                max(1, limit) if limit else None, descending=True
+            )
+        
+        if limit or cursor:
+            appointments, next_cursor = keyset_page(
+                appointment_query(), keyset, cursor, max(1, min(limit or 50, 500)), descending=True
+            )
+            return jsonify({
+                'items': serialize_appointments(appointments, fields),
+                'next_cursor': next_cursor
+            }), 200
+        
+        appointments = appointment_query().order_by(Appointment.appointment_date.desc()).all()
+        
+        appointments_data = serialize_appointments(appointments, fields)
         
         return jsonify(appointments_data), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -440,43 +598,44 @@ def admin_get_appointments():
 @auth_required('token')
 @roles_required('admin')
 def admin_search():
-    """Search doctors and patients"""
+    """Search doctors and patients (ranked, at most ?limit= results per type)"""
     try:
         query = request.args.get('q', '').lower()
         search_type = request.args.get('type', 'all')  # all, doctor, patient
+        limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+        use_index = search_index_available()
         
         results = {'doctors': [], 'patients': []}
         
         if search_type in ['all', 'doctor']:
-            doctors = Doctor.query.join(User).filter(
-                (User.full_name.ilike(f'%{query}%')) | 
-                (User.email.ilike(f'%{query}%'))
-            ).all()
+            doctor_ids = search_profile_ids('doctor', query, ('full_name', 'email'), limit) if use_index else None
             
-            for doc in doctors:
-                results['doctors'].append({
-                    'id': doc.id,
-                    'name': doc.user.full_name,
-                    'email': doc.user.email,
-                    'department': doc.department.name,
-                    'is_active': doc.is_active
-                })
+            if doctor_ids is not None:
+                # Preserve the index's rank order
+                doctors = doctor_query().filter(Doctor.id.in_(doctor_ids)).all()
+                doctors.sort(key=lambda doc: doctor_ids.index(doc.id))
+            else:
+                doctors = doctor_query().join(Doctor.user).filter(
+                    (User.full_name.ilike(f'%{query}%')) | 
+                    (User.email.ilike(f'%{query}%'))
+                ).order_by(User.full_name).limit(limit).all()
+            
+            results['doctors'] = serialize_doctors(doctors, ('id', 'name', 'email', 'department', 'is_active'))
         
         if search_type in ['all', 'patient']:
-            patients = Patient.query.join(User).filter(
-                (User.full_name.ilike(f'%{query}%')) | 
-                (User.email.ilike(f'%{query}%')) |
-                (User.phone.ilike(f'%{query}%'))
-            ).all()
+            patient_ids = search_profile_ids('patient', query, ('full_name', 'email', 'phone'), limit) if use_index else None
             
-            for pat in patients:
-                results['patients'].append({
-                    'id': pat.id,
-                    'name': pat.user.full_name,
-                    'email': pat.user.email,
-                    'phone': pat.user.phone,
-                    'is_active': pat.user.active
-                })
+            if patient_ids is not None:
+                patients = patient_query().filter(Patient.id.in_(patient_ids)).all()
+                patients.sort(key=lambda pat: patient_ids.index(pat.id))
+            else:
+                patients = patient_query().join(Patient.user).filter(
+                    (User.full_name.ilike(f'%{query}%')) | 
+                    (User.email.ilike(f'%{query}%')) |
+                    (User.phone.ilike(f'%{query}%'))
+                ).order_by(User.full_name).limit(limit).all()
+            
+            results['patients'] = serialize_patients(patients, ('id', 'name', 'email', 'phone', 'is_active'))
         
         return jsonify(results), 200
         
@@ -484,16 +643,113 @@ def admin_search():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/admin/analytics', methods=['GET'])
+@auth_required('token')
+@roles_required('admin')
+@cached_view(timeout=3600, depends_on=('analytics',), query_string=True)
+def admin_analytics():
+    """Appointment volume and completion/cancellation/follow-up rates over time"""
+    try:
+        bucket = request.args.get('bucket', 'day')
+        group_by = request.args.get('group_by', 'none')
+        
+        if bucket not in BUCKETS:
+            return jsonify({'error': f"bucket must be one of: {', '.join(BUCKETS)}"}), 400
+        if group_by not in GROUPS:
+            return jsonify({'error': f"group_by must be one of: {', '.join(GROUPS)}"}), 400
+        
+        end_date = request.args.get('end_date')
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else date.today()
+        
+        start_date = request.args.get('start_date')
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else end_date - timedelta(days=29)
+        
+        if end_date < start_date:
+            return jsonify({'error': 'end_date must not be before start_date'}), 400
+        
+        # Served from the rollup table, refreshed by tasks.refresh_analytics_rollups
+        return jsonify({
+            'bucket': bucket,
+            'group_by': group_by,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'series': query_analytics(start_date, end_date, bucket, group_by)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/metrics', methods=['GET'])
+@auth_required('token')
+@roles_required('admin')
+def admin_metrics():
+    """Per-endpoint request metrics for this worker in Prometheus text format"""
+    try:
+        if not app.config['METRICS_ENABLED']:
+            return jsonify({'error': 'Metrics are disabled (set METRICS_ENABLED=1)'}), 404
+        
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/admin/task-metrics', methods=['GET'])
+@auth_required('token')
+@roles_required('admin')
+def admin_task_metrics():
+    """Runtime, throughput, email, queue-wait and SQL figures per Celery task, across all workers"""
+    try:
+        task_names = sorted(name for name in celery.tasks if name.startswith('tasks.'))
+        
+        # End-to-end runs of the fanned-out jobs (coordinator start to last batch done)
+        runs = get_run_metrics([send_daily_reminders.name, send_monthly_reports.name])
+        
+        # One entry per beat schedule, with whether its job's last run finished before the next beat
+        now = celery.now()
+        schedules = {}
+        for entry_name, entry in celery.conf.beat_schedule.items():
+            beat = maybe_schedule(entry['schedule'], app=celery)
+            info = {'task': entry['task'], 'kwargs': entry.get('kwargs', {})}
+            
+            if isinstance(beat, interval_schedule):
+                info['interval_seconds'] = beat.run_every.total_seconds()
+            else:
+                remaining = beat.remaining_estimate(now)
+                info['next_run_at'] = (now + remaining).isoformat()
+                info['seconds_until_next_run'] = round(remaining.total_seconds())
+            
+            last_run = runs.get(entry['task'], {}).get('last_run')
+            if last_run:
+                started = datetime.fromtimestamp(last_run['started_ts'], tz=celery.timezone)
+                next_beat = now + beat.remaining_estimate(started)
+                info['last_run_elapsed_ms'] = last_run['elapsed_ms']
+                info['last_run_finished_before_next_beat'] = last_run['finished_ts'] <= next_beat.timestamp()
+            
+            schedules[entry_name] = info
+        
+        return jsonify({
+            'tasks': get_task_metrics(task_names),
+            'runs': runs,
+            'schedules': schedules
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 # ============= DOCTOR ROUTES =============
 @app.route('/api/doctor/dashboard', methods=['GET'])
 @auth_required('token')
 @roles_required('doctor')
+@cached_view(timeout=600, depends_on=('user:{user_id}',), per_user=True)
 def doctor_dashboard():
     """Doctor dashboard"""
     try:
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+        doctor_id = current_doctor_id()
         
-        if not doctor:
+        if not doctor_id:
             return jsonify({'error': 'Doctor profile not found'}), 404
         
         today = date.today()
@@ -501,34 +757,25 @@ def doctor_dashboard():
         
         # Today's appointments
         today_appointments = Appointment.query.filter(
-            Appointment.doctor_id == doctor.id,
+            Appointment.doctor_id == doctor_id,
             Appointment.appointment_date == today,
             Appointment.status == 'Booked'
         ).count()
         
         # Upcoming appointments (next 7 days)
-        upcoming = Appointment.query.filter(
-            Appointment.doctor_id == doctor.id,
+        upcoming = appointment_query().filter(
+            Appointment.doctor_id == doctor_id,
             Appointment.appointment_date.between(today, week_end),
             Appointment.status == 'Booked'
         ).order_by(Appointment.appointment_date, Appointment.appointment_time).all()
         
         # Total patients seen
         total_patients = db.session.query(Appointment.patient_id).filter(
-            Appointment.doctor_id == doctor.id,
+            Appointment.doctor_id == doctor_id,
             Appointment.status == 'Completed'
         ).distinct().count()
         
-        upcoming_data = []
-        for apt in upcoming:
-            upcoming_data.append({
-                'id': apt.id,
-                'patient_name': apt.patient.user.full_name,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'time': apt.appointment_time.strftime('%H:%M'),
-                'reason': apt.reason,
-                'status': apt.status
-            })
+        upcoming_data = serialize_appointments(upcoming, ('id', 'patient_name', 'date', 'time', 'reason', 'status'))
         
         return jsonify({
             'today_appointments': today_appointments,
@@ -546,24 +793,16 @@ def doctor_dashboard():
 def doctor_get_appointments():
     """Get doctor's appointments"""
     try:
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+        doctor_id = current_doctor_id()
         
-        appointments = Appointment.query.filter_by(doctor_id=doctor.id).order_by(
+        appointments = appointment_query(with_treatment=True).filter_by(doctor_id=doctor_id).order_by(
             Appointment.appointment_date.desc()
         ).all()
         
-        appointments_data = []
-        for apt in appointments:
-            appointments_data.append({
-                'id': apt.id,
-                'patient_name': apt.patient.user.full_name,
-                'patient_id': apt.patient_id,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'time': apt.appointment_time.strftime('%H:%M'),
-                'reason': apt.reason,
-                'status': apt.status,
-                'has_treatment': apt.treatment is not None
-            })
+        appointments_data = serialize_appointments(
+            appointments,
+            ('id', 'patient_name', 'patient_id', 'date', 'time', 'reason', 'status', 'has_treatment')
+        )
         
         return jsonify(appointments_data), 200
         
@@ -580,12 +819,17 @@ def doctor_complete_appointment(appointment_id):
         appointment = Appointment.query.get_or_404(appointment_id)
         
         # Verify doctor owns this appointment
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
-        if appointment.doctor_id != doctor.id:
+        doctor_id = current_doctor_id()
+        if appointment.doctor_id != doctor_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
+        old_status = appointment.status
+        if old_status == 'Booked':
+            release_slot(appointment)
         appointment.status = 'Completed'
+        apply_counters(status_change_deltas(old_status, 'Completed'))
         db.session.commit()
+        bump_appointment_caches(appointment)
         
         return jsonify({'message': 'Appointment marked as completed'}), 200
         
@@ -601,9 +845,9 @@ def doctor_add_treatment(appointment_id):
     """Add/Update treatment details"""
     try:
         appointment = Appointment.query.get_or_404(appointment_id)
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+        doctor_id = current_doctor_id()
         
-        if appointment.doctor_id != doctor.id:
+        if appointment.doctor_id != doctor_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
         data = request.get_json()
@@ -622,9 +866,14 @@ def doctor_add_treatment(appointment_id):
             treatment.follow_up_date = datetime.strptime(data['follow_up_date'], '%Y-%m-%d').date()
         
         # Auto-complete appointment
+        old_status = appointment.status
+        if old_status == 'Booked':
+            release_slot(appointment)
         appointment.status = 'Completed'
+        apply_counters(status_change_deltas(old_status, 'Completed'))
         
         db.session.commit()
+        bump_appointment_caches(appointment)
         
         return jsonify({'message': 'Treatment added successfully'}), 200
         
@@ -638,7 +887,7 @@ def doctor_add_treatment(appointment_id):
 @roles_required('doctor')
 def doctor_availability():
     """Get or add doctor availability"""
-    doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+    doctor_id = current_doctor_id()
     
     if request.method == 'GET':
         try:
@@ -646,7 +895,7 @@ def doctor_availability():
             week_end = today + timedelta(days=7)
             
             availability = DoctorAvailability.query.filter(
-                DoctorAvailability.doctor_id == doctor.id,
+                DoctorAvailability.doctor_id == doctor_id,
                 DoctorAvailability.date.between(today, week_end)
             ).order_by(DoctorAvailability.date).all()
             
@@ -676,7 +925,7 @@ def doctor_availability():
             
             # Check if already exists
             existing = DoctorAvailability.query.filter_by(
-                doctor_id=doctor.id,
+                doctor_id=doctor_id,
                 date=availability_date
             ).first()
             
@@ -684,7 +933,7 @@ def doctor_availability():
                 return jsonify({'error': 'Availability already set for this date'}), 400
             
             availability = DoctorAvailability(
-                doctor_id=doctor.id,
+                doctor_id=doctor_id,
                 date=availability_date,
                 start_time=start_time,
                 end_time=end_time,
@@ -708,10 +957,10 @@ def doctor_availability():
 def doctor_delete_availability(availability_id):
     """Delete availability slot"""
     try:
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+        doctor_id = current_doctor_id()
         availability = DoctorAvailability.query.get_or_404(availability_id)
         
-        if availability.doctor_id != doctor.id:
+        if availability.doctor_id != doctor_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
         db.session.delete(availability)
@@ -728,33 +977,60 @@ def doctor_delete_availability(availability_id):
 @auth_required('token')
 @roles_required('doctor')
 def doctor_get_patients():
-    """Get doctor's patients"""
+    """Get doctor's patients (optional ?q=, ?blood_group=, ?sort=name|appointment_count|last_visit, ?order=asc|desc)"""
     try:
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
-        
-        # Get unique patients
-        patient_ids = db.session.query(Appointment.patient_id).filter(
-            Appointment.doctor_id == doctor.id
-        ).distinct().all()
+        doctor_id = current_doctor_id()
+        
+        appointment_count = func.count(Appointment.id).label('appointment_count')
+        last_visit = func.max(
+            case((Appointment.status == 'Completed', Appointment.appointment_date))
+        ).label('last_visit')
+        
+        # Patient info, appointment count and last visit in one grouped query
+        query = db.session.query(
+            Patient.id,
+            User.full_name,
+            User.email,
+            User.phone,
+            User.blood_group,
+            appointment_count,
+            last_visit
+        ).join(
+            Appointment, Appointment.patient_id == Patient.id
+        ).join(
+            User, User.id == Patient.user_id
+        ).filter(
+            Appointment.doctor_id == doctor_id
+        ).group_by(Patient.id, User.id)
+        
+        search = request.args.get('q')
+        if search:
+            query = query.filter(User.full_name.ilike(f'%{search}%'))
+        
+        blood_group = request.args.get('blood_group')
+        if blood_group:
+            query = query.filter(User.blood_group == blood_group)
+        
+        sort_columns = {
+            'name': User.full_name,
+            'appointment_count': appointment_count,
+            'last_visit': last_visit
+        }
+        sort_column = sort_columns.get(request.args.get('sort', 'name'), User.full_name)
+        if request.args.get('order') == 'desc':
+            sort_column = sort_column.desc()
         
         patients_data = []
-        for (patient_id,) in patient_ids:
-            patient = Patient.query.get(patient_id)
-            if patient:
-                # Count appointments
-                appointment_count = Appointment.query.filter_by(
-                    doctor_id=doctor.id,
-                    patient_id=patient_id
-                ).count()
-                
-                patients_data.append({
-                    'id': patient.id,
-                    'name': patient.user.full_name,
-                    'email': patient.user.email,
-                    'phone': patient.user.phone,
-                    'blood_group': patient.user.blood_group,
-                    'appointment_count': appointment_count
-                })
+        for row in query.order_by(sort_column, Patient.id).all():
+            patients_data.append({
+                'id': row.id,
+                'name': row.full_name,
+                'email': row.email,
+                'phone': row.phone,
+                'blood_group': row.blood_group,
+                'appointment_count': row.appointment_count,
+                'last_visit': row.last_visit.strftime('%Y-%m-%d') if row.last_visit else None
+            })
         
         return jsonify(patients_data), 200
         
@@ -768,25 +1044,18 @@ def doctor_get_patients():
 def doctor_patient_history(patient_id):
     """Get patient's medical history with this doctor"""
     try:
-        doctor = Doctor.query.filter_by(user_id=current_user.id).first()
+        doctor_id = current_doctor_id()
         
-        appointments = Appointment.query.filter(
-            Appointment.doctor_id == doctor.id,
+        appointments = Appointment.query.options(joinedload(Appointment.treatment)).filter(
+            Appointment.doctor_id == doctor_id,
             Appointment.patient_id == patient_id,
             Appointment.status == 'Completed'
         ).order_by(Appointment.appointment_date.desc()).all()
         
-        history_data = []
-        for apt in appointments:
-            treatment = apt.treatment
-            history_data.append({
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'diagnosis': treatment.diagnosis if treatment else 'N/A',
-                'prescription': treatment.prescription if treatment else 'N/A',
-                'notes': treatment.notes if treatment else 'N/A',
-                'follow_up_required': treatment.follow_up_required if treatment else False,
-                'follow_up_date': treatment.follow_up_date.strftime('%Y-%m-%d') if (treatment and treatment.follow_up_date) else None
-            })
+        history_data = serialize_appointments(
+            appointments,
+            ('date', 'diagnosis', 'prescription', 'notes', 'follow_up_required', 'follow_up_date')
+        )
         
         return jsonify(history_data), 200
         
@@ -798,52 +1067,35 @@ def doctor_patient_history(patient_id):
 @app.route('/api/patient/dashboard', methods=['GET'])
 @auth_required('token')
 @roles_required('patient')
+@cached_view(timeout=600, depends_on=('user:{user_id}', 'doctor', 'department'), per_user=True)
 def patient_dashboard():
     """Patient dashboard"""
     try:
-        patient = Patient.query.filter_by(user_id=current_user.id).first()
+        patient_id = current_patient_id()
         
-        if not patient:
+        if not patient_id:
             return jsonify({'error': 'Patient profile not found'}), 404
         
         # Upcoming appointments
         today = date.today()
-        upcoming = Appointment.query.filter(
-            Appointment.patient_id == patient.id,
+        upcoming = appointment_query().filter(
+            Appointment.patient_id == patient_id,
             Appointment.appointment_date >= today,
             Appointment.status == 'Booked'
         ).order_by(Appointment.appointment_date, Appointment.appointment_time).limit(5).all()
         
         # Past appointments
-        past = Appointment.query.filter(
-            Appointment.patient_id == patient.id,
+        past = appointment_query().filter(
+            Appointment.patient_id == patient_id,
             Appointment.status.in_(['Completed', 'Cancelled'])
         ).order_by(Appointment.appointment_date.desc()).limit(5).all()
         
         # Departments
         departments = Department.query.all()
         
-        upcoming_data = []
-        for apt in upcoming:
-            upcoming_data.append({
-                'id': apt.id,
-                'doctor_name': apt.doctor.user.full_name,
-                'department': apt.doctor.department.name,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'time': apt.appointment_time.strftime('%H:%M'),
-                'status': apt.status
-            })
-        
-        past_data = []
-        for apt in past:
-            past_data.append({
-                'id': apt.id,
-                'doctor_name': apt.doctor.user.full_name,
-                'department': apt.doctor.department.name,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'time': apt.appointment_time.strftime('%H:%M'),
-                'status': apt.status
-            })
+        summary_fields = ('id', 'doctor_name', 'department', 'date', 'time', 'status')
+        upcoming_data = serialize_appointments(upcoming, summary_fields)
+        past_data = serialize_appointments(past, summary_fields)
         
         departments_data = [{'id': d.id, 'name': d.name, 'description': d.description} for d in departments]
         
@@ -866,29 +1118,23 @@ def patient_dashboard():
 @app.route('/api/patient/doctors', methods=['GET'])
 @auth_required('token')
 @roles_required('patient')
-@cache.cached(timeout=120, query_string=True)
+@cached_view(timeout=3600, depends_on=('doctor', 'department'), query_string=True)
 def patient_get_doctors():
     """Get doctors (optionally filter by department)"""
     try:
         department_id = request.args.get('department_id', type=int)
         
-        query = Doctor.query.filter_by(is_active=True)
+        query = doctor_query().filter_by(is_active=True)
         
         if department_id:
             query = query.filter_by(department_id=department_id)
         
         doctors = query.all()
         
-        doctors_data = []
-        for doc in doctors:
-            doctors_data.append({
-                'id': doc.id,
-                'name': doc.user.full_name,
-                'email': doc.user.email,
-                'department': doc.department.name,
-                'qualification': doc.qualification,
-                'experience_years': doc.experience_years
-            })
+        doctors_data = serialize_doctors(
+            doctors,
+            ('id', 'name', 'email', 'department', 'qualification', 'experience_years')
+        )
         
         return jsonify(doctors_data), 200
         
@@ -908,39 +1154,15 @@ def patient_doctor_availability(doctor_id):
         
         selected_date = datetime.strptime(selected_date, '%Y-%m-%d').date()
         
-        # Get doctor's availability for the date
-        availability = DoctorAvailability.query.filter_by(
-            doctor_id=doctor_id,
-            date=selected_date,
-            is_available=True
-        ).first()
-        
-        if not availability:
-            return jsonify({'slots': []}), 200
-        
-        # Generate 30-minute time slots
+        # Whole day's occupancy in one grouped query instead of one count per slot
         slots = []
-        current_time = datetime.combine(selected_date, availability.start_time)
-        end_time = datetime.combine(selected_date, availability.end_time)
-        
-        while current_time < end_time:
-            slot_time = current_time.time()
-            
-            # Check how many appointments already booked for this slot
-            booked_count = Appointment.query.filter(
-                Appointment.doctor_id == doctor_id,
-                Appointment.appointment_date == selected_date,
-                Appointment.appointment_time == slot_time,
-                Appointment.status == 'Booked'
-            ).count()
-            
-            if booked_count < availability.max_patients:
+        for slot in get_slot_occupancy(doctor_id, selected_date):
+            if slot['remaining'] > 0:
                 slots.append({
-                    'time': slot_time.strftime('%H:%M'),
-                    'available': True
+                    'time': slot['time'].strftime('%H:%M'),
+                    'available': True,
+                    'remaining': slot['remaining']
                 })
-            
-            current_time += timedelta(minutes=30)
         
         return jsonify({'slots': slots}), 200
         
@@ -948,13 +1170,65 @@ def patient_doctor_availability(doctor_id):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/patient/availability/search', methods=['GET'])
+@auth_required('token')
+@roles_required('patient')
+def patient_search_availability():
+    """Find the earliest open slots across doctors and dates"""
+    try:
+        department_id = request.args.get('department_id', type=int)
+        doctor_ids = [int(d) for d in request.args.get('doctor_ids', '').split(',') if d.strip()]
+        
+        if not department_id and not doctor_ids:
+            return jsonify({'error': 'department_id or doctor_ids parameter required'}), 400
+        
+        start_date = request.args.get('start_date')
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else date.today()
+        
+        end_date = request.args.get('end_date')
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else start_date + timedelta(days=7)
+        
+        if end_date < start_date:
+            return jsonify({'error': 'end_date must not be before start_date'}), 400
+        
+        # Keep the search window and result size bounded
+        end_date = min(end_date, start_date + timedelta(days=31))
+        limit = min(request.args.get('limit', 10, type=int), 50)
+        
+        slots = find_open_slots(
+            start_date,
+            end_date,
+            doctor_ids=doctor_ids,
+            department_id=department_id,
+            limit=limit
+        )
+        
+        slots_data = []
+        for slot in slots:
+            slots_data.append({
+                'doctor_id': slot['doctor_id'],
+                'doctor_name': slot['doctor_name'],
+                'department': slot['department'],
+                'date': slot['date'].strftime('%Y-%m-%d'),
+                'time': slot['time'].strftime('%H:%M'),
+                'remaining': slot['remaining']
+            })
+        
+        return jsonify({'slots': slots_data}), 200
+        
+    except ValueError:
+        return jsonify({'error': 'Invalid date or doctor id format'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/patient/appointment/book', methods=['POST'])
 @auth_required('token')
 @roles_required('patient')
 def patient_book_appointment():
     """Book an appointment"""
     try:
-        patient = Patient.query.filter_by(user_id=current_user.id).first()
+        patient_id = current_patient_id()
         data = request.get_json()
         
         doctor_id = data['doctor_id']
@@ -971,20 +1245,14 @@ def patient_book_appointment():
         if not availability:
             return jsonify({'error': 'Doctor not available on this date'}), 400
         
-        # Check if slot is full
-        booked_count = Appointment.query.filter(
-            Appointment.doctor_id == doctor_id,
-            Appointment.appointment_date == appointment_date,
-            Appointment.appointment_time == appointment_time,
-            Appointment.status == 'Booked'
-        ).count()
-        
-        if booked_count >= availability.max_patients:
+        # Atomically claim a place in the slot (no read-count-then-insert race)
+        if not reserve_slot(doctor_id, appointment_date, appointment_time, availability.max_patients):
+            db.session.rollback()
             return jsonify({'error': 'This time slot is fully booked'}), 400
         
-        # Create appointment
+        # Create appointment in the same transaction as the counter update
         appointment = Appointment(
-            patient_id=patient.id,
+            patient_id=patient_id,
             doctor_id=doctor_id,
             appointment_date=appointment_date,
             appointment_time=appointment_time,
@@ -993,9 +1261,11 @@ def patient_book_appointment():
         )
         
         db.session.add(appointment)
+        department_id = db.session.query(Doctor.department_id).filter_by(id=doctor_id).scalar()
+        apply_counters(booking_deltas(appointment_date, department_id))
         db.session.commit()
         
-        cache.delete('admin_dashboard')
+        bump_appointment_caches(appointment)
         
         return jsonify({
             'message': 'Appointment booked successfully',
@@ -1013,24 +1283,16 @@ def patient_book_appointment():
 def patient_get_appointments():
     """Get patient's appointments"""
     try:
-        patient = Patient.query.filter_by(user_id=current_user.id).first()
+        patient_id = current_patient_id()
         
-        appointments = Appointment.query.filter_by(patient_id=patient.id).order_by(
+        appointments = appointment_query(with_treatment=True).filter_by(patient_id=patient_id).order_by(
             Appointment.appointment_date.desc()
         ).all()
         
-        appointments_data = []
-        for apt in appointments:
-            appointments_data.append({
-                'id': apt.id,
-                'doctor_name': apt.doctor.user.full_name,
-                'department': apt.doctor.department.name,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'time': apt.appointment_time.strftime('%H:%M'),
-                'reason': apt.reason,
-                'status': apt.status,
-                'has_treatment': apt.treatment is not None
-            })
+        appointments_data = serialize_appointments(
+            appointments,
+            ('id', 'doctor_name', 'department', 'date', 'time', 'reason', 'status', 'has_treatment')
+        )
         
         return jsonify(appointments_data), 200
         
@@ -1044,19 +1306,21 @@ def patient_get_appointments():
 def patient_cancel_appointment(appointment_id):
     """Cancel an appointment"""
     try:
-        patient = Patient.query.filter_by(user_id=current_user.id).first()
+        patient_id = current_patient_id()
         appointment = Appointment.query.get_or_404(appointment_id)
         
-        if appointment.patient_id != patient.id:
+        if appointment.patient_id != patient_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
         if appointment.status != 'Booked':
             return jsonify({'error': 'Can only cancel booked appointments'}), 400
         
+        release_slot(appointment)
         appointment.status = 'Cancelled'
+        apply_counters(status_change_deltas('Booked', 'Cancelled'))
         db.session.commit()
         
-        cache.delete('admin_dashboard')
+        bump_appointment_caches(appointment)
         
         return jsonify({'message': 'Appointment cancelled successfully'}), 200
         
@@ -1071,27 +1335,17 @@ def patient_cancel_appointment(appointment_id):
 def patient_medical_history():
     """Get patient's medical history"""
     try:
-        patient = Patient.query.filter_by(user_id=current_user.id).first()
+        patient_id = current_patient_id()
         
-        appointments = Appointment.query.filter(
-            Appointment.patient_id == patient.id,
+        appointments = appointment_query(with_treatment=True).filter(
+            Appointment.patient_id == patient_id,
             Appointment.status == 'Completed'
         ).order_by(Appointment.appointment_date.desc()).all()
         
-        history_data = []
-        for apt in appointments:
-            treatment = apt.treatment
-            history_data.append({
-                'id': apt.id,
-                'date': apt.appointment_date.strftime('%Y-%m-%d'),
-                'doctor_name': apt.doctor.user.full_name,
-                'department': apt.doctor.department.name,
-                'diagnosis': treatment.diagnosis if treatment else 'N/A',
-                'prescription': treatment.prescription if treatment else 'N/A',
-                'notes': treatment.notes if treatment else 'N/A',
-                'follow_up_required': treatment.follow_up_required if treatment else False,
-                'follow_up_date': treatment.follow_up_date.strftime('%Y-%m-%d') if (treatment and treatment.follow_up_date) else None
-            })
+        history_data = serialize_appointments(
+            appointments,
+            ('id', 'date', 'doctor_name', 'department', 'diagnosis', 'prescription', 'notes', 'follow_up_required', 'follow_up_date')
+        )
         
         return jsonify(history_data), 200
         
@@ -1134,6 +1388,9 @@ def patient_profile():
                 current_user.date_of_birth = datetime.strptime(data['date_of_birth'], '%Y-%m-%d').date()
             
             db.session.commit()
+            bump('patient', user_entity(current_user.id))
+            bump_patient_doctor_caches(current_patient_id())
+            invalidate_identity(current_user.id)
             
             return jsonify({'message': 'Profile updated successfully'}), 200
             
@@ -1148,11 +1405,23 @@ def patient_profile():
 def patient_export_history():
     """Trigger CSV export of treatment history"""
     try:
-        from tasks import export_treatment_csv
-        patient = Patient.query.filter_by(user_id=current_user.id).first()
+        from task import export_treatment_csv
+        patient_id = current_patient_id()
+        
+        data = request.get_json(silent=True) or {}
+        compress = bool(data.get('compress'))
+        
+        # Unchanged history: hand back the existing artifact instead of regenerating it
+        filename = find_cached_export(patient_id, compress)
+        if filename:
+            return jsonify({
+                'message': 'Export ready',
+                'filename': filename,
+                'download_url': f'/static/{filename}'
+            }), 200
         
         # Trigger Celery task
-        task = export_treatment_csv.delay(patient.id)
+        task = export_treatment_csv.delay(patient_id, compress=compress)
         
         return jsonify({
             'message': 'Export started. You will receive an email when ready.',
@@ -1163,6 +1432,35 @@ def patient_export_history():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/patient/export-history/download', methods=['GET'])
+@auth_required('token')
+@roles_required('patient')
+def patient_download_history():
+    """Stream treatment history CSV directly; large histories fall back to the Celery export"""
+    try:
+        patient_id = current_patient_id()
+        
+        if count_treatment_history(patient_id) > SYNC_EXPORT_MAX_ROWS:
+            from task import export_treatment_csv
+            task = export_treatment_csv.delay(patient_id)
+            
+            return jsonify({
+                'message': 'History is large; export started. You will receive an email when ready.',
+                'task_id': task.id
+            }), 202
+        
+        filename = f"treatment_history_{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        
+        return Response(
+            stream_with_context(iter_treatment_csv(patient_id)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/patient/export-status/<task_id>', methods=['GET'])
 @auth_required('token')
 @roles_required('patient')
@@ -1195,19 +1493,21 @@ def download_file(filename):
 
 # ============= COMMON ROUTES =============
 @app.route('/api/departments', methods=['GET'])
-@cache.cached(timeout=3600)
+@cached_view(timeout=86400, depends_on=('department', 'doctor'))
 def get_departments():
     """Get all departments"""
     try:
         departments = Department.query.all()
         
+        # Active doctor count for every department in one grouped query
+        doctor_counts = dict(db.session.query(
+            Doctor.department_id,
+            func.count(Doctor.id)
+        ).filter(Doctor.is_active == True).group_by(Doctor.department_id).all())
+        
         departments_data = []
         for dept in departments:
-            # Count active doctors in department
-            doctor_count = Doctor.query.filter_by(
-                department_id=dept.id,
-                is_active=True
-            ).count()
+            doctor_count = doctor_counts.get(dept.id, 0)
             
             departments_data.append({
                 'id': dept.id,
@@ -1246,9 +1546,9 @@ def get_user_profile():
                 profile['qualification'] = doctor.qualification
         
         elif role == 'patient':
-            patient = Patient.query.filter_by(user_id=current_user.id).first()
-            if patient:
-                profile['patient_id'] = patient.id
+            patient_id = current_patient_id()
+            if patient_id:
+                profile['patient_id'] = patient_id
                 profile['blood_group'] = current_user.blood_group
         
         return jsonify(profile), 200
@@ -1275,4 +1575,8 @@ if __name__ == '__main__':
     os.makedirs('static', exist_ok=True)
     os.makedirs('templates', exist_ok=True)
     
+    # The development server initializes the database itself for convenience
+    with app.app_context():
+        init_db()
+    
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""Login throughput per worker process.
+
+Usage: python bench_login.py [--threads 8] [--requests 200]
+
+Runs against a throwaway SQLite database and an in-process cache unless
+DATABASE_URL / CACHE_TYPE are set. BCRYPT_ROUNDS, PASSWORD_HASH and
+LOGIN_HASH_WORKERS are honoured, so hashing settings can be compared.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_login.db'))
+os.environ.setdefault('CACHE_TYPE', 'SimpleCache')
+
+from app import app, db, user_datastore, hash_password, init_db  # noqa: E402
+
+EMAIL = 'bench@hospital.com'
+PASSWORD = 'bench-password'
+
+
+def setup_user():
+    with app.app_context():
+        init_db()
+        if not user_datastore.find_user(email=EMAIL):
+            user_datastore.create_user(
+                username='bench',
+                full_name='Bench User',
+                email=EMAIL,
+                password=hash_password(PASSWORD),
+                active=True,
+                roles=['patient']
+            )
+            db.session.commit()
+
+
+def login(password):
+    with app.test_client() as client:
+        return client.post('/api/login', json={'email': EMAIL, 'password': password}).status_code
+
+
+def run(label, password, threads, requests):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(login, [password] * requests))
+    elapsed = time.perf_counter() - start
+    print(f'{label:<22} {requests / elapsed:8.1f} logins/s  ({elapsed:.2f}s, statuses {sorted(set(statuses))})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_user()
+    print(f"hash={app.config['SECURITY_PASSWORD_HASH']} threads={args.threads} requests={args.requests}")
+    run('valid credentials', PASSWORD, args.threads, args.requests)
+    run('repeated bad password', 'wrong-password', args.threads, args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Cold-start cost of importing the app in a fresh worker process.
+
+Usage: python bench_startup.py [--runs 5]
+
+Each run imports app.py in a new interpreter against a throwaway SQLite
+database (unless DATABASE_URL is set) and reports the import time and
+whether the import touched the database. The one-off `init-db` command
+is timed separately for comparison.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import app; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def run_import(env):
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SNIPPET],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def run_init_db(env):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'init-db'],
+        env=env, capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench_startup.db')
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite:///' + db_path)
+    env.setdefault('CACHE_TYPE', 'SimpleCache')
+
+    timings = [run_import(env) for _ in range(args.runs)]
+    touched = os.path.exists(db_path)
+    print(f'import app         median {statistics.median(timings) * 1000:7.1f} ms  '
+          f'(min {min(timings) * 1000:.1f}, max {max(timings) * 1000:.1f}, runs {args.runs})')
+    print(f'database touched   {"yes" if touched else "no"}')
+    print(f'flask init-db      {run_init_db(env) * 1000:7.1f} ms  (once per deploy)')
+
+
+if __name__ == '__main__':
+    main()
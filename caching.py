@@ -0,0 +1,130 @@
+from flask import request
+from flask_caching import Cache
+from flask_security import current_user
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+cache = Cache()
+
+# Resolved auth identities: a short in-process layer in front of the shared cache
+IDENTITY_LOCAL_TTL = 30
+IDENTITY_SHARED_TTL = 300
+IDENTITY_LOCAL_MAX_ENTRIES = 10000
+_local_identities = OrderedDict()  # user_id -> (expires_at, identity), oldest write first
+_local_identities_lock = threading.Lock()
+
+# Cached views declare the entities they depend on ('doctor', 'department',
+# 'patient', 'appointment'); writes bump only those entities' versions.
+# Per-user views may depend on 'user:{user_id}', bumped when that user's
+# profile, appointments or treatments change.
+
+
+def _version_key(entity):
+    return f'cache_version:{entity}'
+
+
+def get_versions(entities):
+    """Current version of each entity, initialising any that are missing or evicted"""
+    keys = [_version_key(entity) for entity in entities]
+    versions = list(cache.get_many(*keys))
+
+    for i, version in enumerate(versions):
+        if version is None:
+            # Time-based seed so an evicted counter never reuses an old version
+            cache.add(keys[i], int(time.time() * 1000), timeout=0)
+            versions[i] = cache.get(keys[i])
+
+    return versions
+
+
+def bump(*entities):
+    """Invalidate every cached view that depends on any of the given entities"""
+    for entity in entities:
+        key = _version_key(entity)
+        cache.add(key, int(time.time() * 1000), timeout=0)
+        cache.cache.inc(key)
+
+
+def user_entity(user_id):
+    """Version entity covering one user's own dashboard data"""
+    return f'user:{user_id}'
+
+
+def versioned_key(prefix, depends_on, query_string=False, per_user=False):
+    """Cache key builder embedding the current versions of the view's dependencies"""
+    def make_key():
+        entities = depends_on
+        parts = [prefix]
+
+        if per_user:
+            entities = [entity.format(user_id=current_user.id) for entity in depends_on]
+            parts.append(f'u{current_user.id}')
+
+        versions = get_versions(entities)
+        parts += [f'{entity}{version}' for entity, version in zip(entities, versions)]
+
+        if query_string:
+            args = sorted(request.args.items(multi=True))
+            parts.append(hashlib.md5(str(args).encode()).hexdigest())
+
+        return ':'.join(parts)
+
+    return make_key
+
+
+def _is_success(rv):
+    """Only cache successful responses, never error payloads"""
+    if isinstance(rv, tuple):
+        return len(rv) < 2 or rv[1] == 200
+    return getattr(rv, 'status_code', 200) == 200
+
+
+def cached_view(timeout, depends_on, key_prefix=None, query_string=False, per_user=False):
+    """Cache a view until its TTL expires or any entity it depends on is bumped"""
+    def decorator(f):
+        make_key = versioned_key(key_prefix or f'view:{f.__name__}', depends_on, query_string, per_user)
+        return cache.cached(timeout=timeout, key_prefix=make_key, response_filter=_is_success)(f)
+
+    return decorator
+
+
+def _identity_key(user_id):
+    return f'identity:{user_id}'
+
+
+def get_identity(user_id, loader):
+    """Profile ids for a user from the process cache, then the shared cache, then loader(user_id)"""
+    now = time.monotonic()
+    with _local_identities_lock:
+        entry = _local_identities.get(user_id)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    identity = cache.get(_identity_key(user_id))
+    if identity is None:
+        identity = loader(user_id)
+        cache.set(_identity_key(user_id), identity, timeout=IDENTITY_SHARED_TTL)
+
+    with _local_identities_lock:
+        _local_identities[user_id] = (now + IDENTITY_LOCAL_TTL, identity)
+        _local_identities.move_to_end(user_id)
+        _prune_local_identities(now)
+    return identity
+
+
+def _prune_local_identities(now):
+    """Drop expired entries, then the oldest beyond the size cap (entries are ordered by expiry)"""
+    while _local_identities:
+        expires_at = next(iter(_local_identities.values()))[0]
+        if expires_at > now and len(_local_identities) <= IDENTITY_LOCAL_MAX_ENTRIES:
+            break
+        _local_identities.popitem(last=False)
+
+
+def invalidate_identity(user_id):
+    """Forget a user's cached identity (other workers' process caches expire within IDENTITY_LOCAL_TTL)"""
+    with _local_identities_lock:
+        _local_identities.pop(user_id, None)
+    cache.delete(_identity_key(user_id))
@@ -25,4 +25,22 @@ beat_schedule = {
         'schedule': 86400.0,  # Run daily (for testing)
         # For production: 'schedule': crontab(day_of_month=1, hour=9, minute=0),  # 1st of month at 9 AM
     },
+    'evict-export-artifacts': {
+        'task': 'tasks.evict_export_artifacts',
+        'schedule': 21600.0,  # Every 6 hours
+    },
+    'reconcile-stat-counters': {
+        'task': 'tasks.reconcile_stat_counters',
+        'schedule': 86400.0,  # Daily
+        # For production: 'schedule': crontab(hour=3, minute=0),  # 3 AM daily
+    },
+    'refresh-analytics-rollups': {
+        'task': 'tasks.refresh_analytics_rollups',
+        'schedule': 900.0,  # Every 15 minutes (incremental)
+    },
+    'rebuild-analytics-rollups': {
+        'task': 'tasks.refresh_analytics_rollups',
+        'schedule': 604800.0,  # Weekly full rebuild, picks up doctors moved between departments
+        'kwargs': {'full': True},
+    },
 }
\ No newline at end of file
@@ -0,0 +1,191 @@
+from sqlalchemy import func
+from models import db, User, Doctor, Department, Appointment, Treatment
+from queries import STREAM_BATCH_SIZE
+import csv
+import glob
+import gzip
+import hashlib
+import io
+import os
+import time
+
+EXPORT_DIR = 'static'
+
+# Histories up to this many rows are streamed directly instead of going through Celery
+SYNC_EXPORT_MAX_ROWS = 1000
+
+# Rows buffered per chunk of a streamed HTTP response
+CSV_CHUNK_ROWS = 100
+
+# Eviction policy for cached export artifacts in EXPORT_DIR
+EXPORT_MAX_AGE_SECONDS = 7 * 86400
+EXPORT_MAX_TOTAL_BYTES = 500 * 1024 * 1024
+
+TREATMENT_CSV_FIELDS = [
+    'Appointment Date',
+    'Doctor Name',
+    'Department',
+    'Diagnosis',
+    'Prescription',
+    'Notes',
+    'Follow-up Required',
+    'Follow-up Date'
+]
+
+
+def treatment_history_rows(patient_id):
+    """Yield CSV rows for a patient's completed appointments, reading joined columns in chunks"""
+    rows = db.session.query(
+        Appointment.appointment_date,
+        User.full_name,
+        Department.name,
+        Treatment.id,
+        Treatment.diagnosis,
+        Treatment.prescription,
+        Treatment.notes,
+        Treatment.follow_up_required,
+        Treatment.follow_up_date
+    ).join(
+        Doctor, Doctor.id == Appointment.doctor_id
+    ).join(
+        User, User.id == Doctor.user_id
+    ).join(
+        Department, Department.id == Doctor.department_id
+    ).outerjoin(
+        Treatment, Treatment.appointment_id == Appointment.id
+    ).filter(
+        Appointment.patient_id == patient_id,
+        Appointment.status == 'Completed'
+    ).order_by(Appointment.appointment_date.desc()).yield_per(STREAM_BATCH_SIZE)
+
+    for (appointment_date, doctor_name, department, treatment_id, diagnosis,
+         prescription, notes, follow_up_required, follow_up_date) in rows:
+        has_treatment = treatment_id is not None
+        yield [
+            appointment_date.strftime('%d-%m-%Y'),
+            f"Dr. {doctor_name}",
+            department,
+            diagnosis if has_treatment else 'N/A',
+            prescription if has_treatment else 'N/A',
+            notes if has_treatment else 'N/A',
+            'Yes' if (has_treatment and follow_up_required) else 'No',
+            follow_up_date.strftime('%d-%m-%Y') if follow_up_date else 'N/A'
+        ]
+
+
+def count_treatment_history(patient_id):
+    """Number of rows a treatment history export would contain"""
+    return Appointment.query.filter(
+        Appointment.patient_id == patient_id,
+        Appointment.status == 'Completed'
+    ).count()
+
+
+def iter_treatment_csv(patient_id):
+    """Yield the treatment history CSV as text chunks for a streamed response"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TREATMENT_CSV_FIELDS)
+
+    for i, row in enumerate(treatment_history_rows(patient_id), 1):
+        writer.writerow(row)
+        if i % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def write_treatment_csv(filepath, patient_id, compress=False):
+    """Write the treatment history CSV incrementally, gzip-compressed if requested; returns row count"""
+    opener = gzip.open if compress else open
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+
+    # Write beside the target and rename, so a cached artifact is never seen half-written
+    tmp_path = f'{filepath}.tmp{os.getpid()}'
+    count = 0
+    with opener(tmp_path, 'wt', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(TREATMENT_CSV_FIELDS)
+        for row in treatment_history_rows(patient_id):
+            writer.writerow(row)
+            count += 1
+
+    os.replace(tmp_path, filepath)
+    return count
+
+
+# ============= EXPORT ARTIFACT CACHE =============
+def export_version(patient_id):
+    """Version of a patient's exportable data, changing whenever an appointment or treatment changes"""
+    last_appointment, last_treatment, total = db.session.query(
+        func.max(Appointment.updated_at),
+        func.max(Treatment.updated_at),
+        func.count(Appointment.id)
+    ).outerjoin(
+        Treatment, Treatment.appointment_id == Appointment.id
+    ).filter(
+        Appointment.patient_id == patient_id,
+        Appointment.status == 'Completed'
+    ).one()
+
+    raw = f'{last_appointment}|{last_treatment}|{total}'
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def export_filename(patient_id, version, compress=False):
+    return f"treatment_history_{patient_id}_{version}.csv" + (".gz" if compress else "")
+
+
+def find_cached_export(patient_id, compress=False):
+    """Filename of an up-to-date export artifact for the patient, or None"""
+    filename = export_filename(patient_id, export_version(patient_id), compress)
+    if os.path.exists(os.path.join(EXPORT_DIR, filename)):
+        return filename
+    return None
+
+
+def remove_superseded_exports(patient_id, version):
+    """Delete a patient's export artifacts for other data versions, keeping every format of this one"""
+    current = export_filename(patient_id, version)
+    for path in glob.glob(os.path.join(EXPORT_DIR, f'treatment_history_{patient_id}_*.csv*')):
+        if not os.path.basename(path).startswith(current) and '.tmp' not in path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def evict_exports(max_age=EXPORT_MAX_AGE_SECONDS, max_total_bytes=EXPORT_MAX_TOTAL_BYTES):
+    """Drop artifacts older than max_age, then oldest first until the directory fits max_total_bytes"""
+    now = time.time()
+    artifacts = []
+    removed = 0
+
+    for path in glob.glob(os.path.join(EXPORT_DIR, 'treatment_history_*.csv*')):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if now - stat.st_mtime > max_age:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        else:
+            artifacts.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in artifacts)
+    for _, size, path in sorted(artifacts):
+        if total <= max_total_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+            total -= size
+        except OSError:
+            pass
+
+    return removed
@@ -0,0 +1,130 @@
+import os
+import smtplib
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.base import MIMEBase
+from email import encoders
+
+# Email Configuration
+SMTP_SERVER_HOST = os.environ.get('SMTP_SERVER_HOST', 'localhost')  # Change to your SMTP server
+SMTP_SERVER_PORT = int(os.environ.get('SMTP_SERVER_PORT', 1025))  # Mailhog default port
+SENDER_ADDRESS = "hospital@noreply.com"
+SENDER_PASSWORD = ""
+
+# Connection reuse and retry tuning
+SMTP_TIMEOUT = 30
+MAX_MESSAGES_PER_CONNECTION = 100  # reconnect periodically; many servers cap messages per session
+IDLE_RECONNECT_SECONDS = 60  # servers drop idle sessions, so don't trust an old one
+SEND_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 1.0
+
+
+def build_message(to_address, subject, message, content="html", attachment_file=None):
+    """Build a MIME message with optional attachment"""
+    msg = MIMEMultipart()
+    msg['From'] = SENDER_ADDRESS
+    msg['To'] = to_address
+    msg['Subject'] = subject
+
+    if content == "html":
+        msg.attach(MIMEText(message, "html"))
+    else:
+        msg.attach(MIMEText(message, "plain"))
+
+    if attachment_file and os.path.exists(attachment_file):
+        with open(attachment_file, 'rb') as attachment:
+            part = MIMEBase("application", "octet-stream")
+            part.set_payload(attachment.read())
+
+        encoders.encode_base64(part)
+        filename = os.path.basename(attachment_file)
+        part.add_header("Content-Disposition", f"attachment; filename={filename}")
+        msg.attach(part)
+
+    return msg
+
+
+def _is_transient(error):
+    """Connection drops and 4xx replies are worth retrying; 5xx and refused recipients are not"""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, OSError)
+
+
+class MailTransport:
+    """Persistent SMTP session that sends many messages over one connection"""
+
+    def __init__(self, host=SMTP_SERVER_HOST, port=SMTP_SERVER_PORT,
+                 username=SENDER_ADDRESS, password=SENDER_PASSWORD):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self._smtp = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(host=self.host, port=self.port, timeout=SMTP_TIMEOUT)
+        smtp.ehlo()
+        if smtp.has_extn('auth'):
+            smtp.login(self.username, self.password)
+        self._smtp = smtp
+        self._sent_on_connection = 0
+
+    def _connection(self):
+        stale = time.monotonic() - self._last_used > IDLE_RECONNECT_SECONDS
+        if self._smtp is not None and (stale or self._sent_on_connection >= MAX_MESSAGES_PER_CONNECTION):
+            self.close()
+        if self._smtp is None:
+            self._connect()
+        return self._smtp
+
+    def close(self):
+        """Quit the current session, ignoring errors from an already dead connection"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def send(self, msg):
+        """Send one message, reconnecting and retrying transient failures"""
+        with self._lock:
+            for attempt in range(1, SEND_RETRIES + 1):
+                try:
+                    self._connection().send_message(msg)
+                    self._sent_on_connection += 1
+                    self._last_used = time.monotonic()
+                    return True
+                except Exception as e:
+                    self.close()
+                    if not _is_transient(e) or attempt == SEND_RETRIES:
+                        print(f"Email sending failed: {e}")
+                        return False
+                    time.sleep(RETRY_BACKOFF_SECONDS * attempt)
+
+
+_transport = None
+
+
+def get_transport():
+    """Per-process transport, so consecutive tasks in a worker reuse its SMTP session"""
+    global _transport
+    if _transport is None:
+        _transport = MailTransport()
+    return _transport
@@ -0,0 +1,171 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from caching import cache
+import threading
+import time
+
+# Opt-in per-request instrumentation (METRICS_ENABLED=1). Metrics are kept per worker
+# process and rendered in the Prometheus text exposition format.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+_METRIC_INFO = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Request latency'),
+    'http_request_sql_statements': ('histogram', 'SQL statements executed per request'),
+    'http_request_db_seconds_total': ('counter', 'Time spent executing SQL, by endpoint'),
+    'cache_requests_total': ('counter', 'Flask-Caching lookups, by key space and result')
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> (buckets, [count per bucket..., +Inf], [sum])
+
+
+def _inc(name, labels, amount=1):
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + amount
+
+
+def _observe(name, labels, value, buckets):
+    with _lock:
+        entry = _histograms.get((name, labels))
+        if entry is None:
+            entry = _histograms[(name, labels)] = (buckets, [0] * (len(buckets) + 1), [0.0])
+        counts = entry[1]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        entry[2][0] += value
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_metrics():
+    """All recorded metrics in Prometheus text format"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (buckets, list(counts), total[0]) for key, (buckets, counts, total) in _histograms.items()}
+
+    lines = []
+    for name, (kind, description) in _METRIC_INFO.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            continue
+
+        for (metric, labels), (buckets, counts, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# ============= REQUEST HOOKS =============
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_statements = 0
+    g.metrics_sql_seconds = 0.0
+
+
+def _finish_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+
+    endpoint = request.endpoint or 'unmatched'
+    labels = (('endpoint', endpoint), ('method', request.method))
+
+    _inc('http_requests_total', labels + (('status', response.status_code),))
+    _observe('http_request_duration_seconds', labels, time.perf_counter() - start, LATENCY_BUCKETS)
+    _observe('http_request_sql_statements', labels, g.get('metrics_sql_statements', 0), STATEMENT_BUCKETS)
+    _inc('http_request_db_seconds_total', (('endpoint', endpoint),), g.get('metrics_sql_seconds', 0.0))
+
+    return response
+
+
+# ============= SQL EVENTS =============
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+
+    # Statements outside a request (startup, pool threads) are not attributed to any endpoint
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_sql_statements += 1
+        g.metrics_sql_seconds += elapsed
+
+
+# ============= CACHE LOOKUPS =============
+def _keyspace(key):
+    return str(key).split(':', 1)[0]
+
+
+def _record_lookup(key, value):
+    result = 'miss' if value is None else 'hit'
+    _inc('cache_requests_total', (('keyspace', _keyspace(key)), ('result', result)))
+
+
+def _instrument_cache_backend(backend):
+    """Count hits and misses on the backend, which both cache.get and @cache.cached go through"""
+    get, get_many = backend.get, backend.get_many
+
+    def counted_get(key):
+        value = get(key)
+        _record_lookup(key, value)
+        return value
+
+    def counted_get_many(*keys):
+        values = get_many(*keys)
+        for key, value in zip(keys, values):
+            _record_lookup(key, value)
+        return values
+
+    backend.get = counted_get
+    backend.get_many = counted_get_many
+
+
+def init_metrics(app):
+    """Attach request, SQL and cache instrumentation to the app"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    with app.app_context():
+        _instrument_cache_backend(cache.cache)
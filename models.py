@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_security import UserMixin, RoleMixin
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
+import sqlite3
 
 db = SQLAlchemy()
 
@@ -81,6 +84,9 @@ class Doctor(db.Model):
 class Patient(db.Model):
     """Patient profile"""
     __tablename__ = 'patient'
+    __table_args__ = (
+        db.Index('ix_patient_created_at_id', 'created_at', 'id'),  # keyset pagination
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
@@ -93,6 +99,9 @@ class Patient(db.Model):
 class DoctorAvailability(db.Model):
     """Doctor's available time slots"""
     __tablename__ = 'doctor_availability'
+    __table_args__ = (
+        db.Index('ix_doctor_availability_lookup', 'doctor_id', 'date', 'is_available'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
@@ -104,9 +113,29 @@ class DoctorAvailability(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class SlotCapacity(db.Model):
+    """Booked-place counter per doctor slot, updated atomically on booking/cancel"""
+    __tablename__ = 'slot_capacity'
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'slot_date', 'slot_time', name='uq_slot_capacity_slot'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    slot_date = db.Column(db.Date, nullable=False)
+    slot_time = db.Column(db.Time, nullable=False)
+    booked_count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Appointment(db.Model):
     """Patient appointments with doctors"""
     __tablename__ = 'appointment'
+    __table_args__ = (
+        db.Index('ix_appointment_doctor_slot', 'doctor_id', 'appointment_date', 'appointment_time', 'status'),
+        db.Index('ix_appointment_patient_status', 'patient_id', 'status'),
+        db.Index('ix_appointment_date_id', 'appointment_date', 'id'),  # date filters and keyset pagination
+        db.Index('ix_appointment_updated_at', 'updated_at'),  # incremental analytics refresh
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
@@ -124,6 +153,9 @@ class Appointment(db.Model):
 class Treatment(db.Model):
     """Treatment records for completed appointments"""
     __tablename__ = 'treatment'
+    __table_args__ = (
+        db.Index('ix_treatment_updated_at', 'updated_at'),  # incremental analytics refresh
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), unique=True, nullable=False)
@@ -133,4 +165,75 @@ class Treatment(db.Model):
     follow_up_required = db.Column(db.Boolean, default=False)
     follow_up_date = db.Column(db.Date)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class NotificationLog(db.Model):
+    """Delivery ledger: one row per appointment and notification type"""
+    __tablename__ = 'notification_log'
+    __table_args__ = (
+        db.UniqueConstraint('appointment_id', 'notification_type', name='uq_notification_log_appointment_type'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointment.id'), nullable=False)
+    notification_type = db.Column(db.String(30), nullable=False)  # daily_reminder
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    sent_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class StatCounter(db.Model):
+    """Incrementally maintained dashboard counter (e.g. 'appointments:day:2024-01-31')"""
+    __tablename__ = 'stat_counter'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(100), unique=True, nullable=False)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class AppointmentRollup(db.Model):
+    """Pre-aggregated appointment outcomes per day and doctor, refreshed by the analytics job"""
+    __tablename__ = 'appointment_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'doctor_id', name='uq_appointment_rollup_day_doctor'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    booked = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    follow_ups = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RollupWatermark(db.Model):
+    """Point up to which a rollup table reflects source-table changes"""
+    __tablename__ = 'rollup_watermark'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    refreshed_through = db.Column(db.DateTime, nullable=False)
+
+
+def ensure_indexes(engine):
+    """Create declared indexes missing from tables that predate them (create_all skips existing tables)"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the single writer (busy timeout comes from connect_args)"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
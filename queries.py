@@ -0,0 +1,194 @@
+from flask import Response, stream_with_context
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from models import Doctor, Patient, Appointment
+from datetime import date, datetime
+import base64
+import json
+
+# Rows fetched per round trip when streaming large listings
+STREAM_BATCH_SIZE = 500
+
+
+# ============= EAGER-LOADED QUERIES =============
+def appointment_query(with_treatment=False):
+    """Appointment query with patient, doctor and department loaded in the same SELECT"""
+    options = [
+        joinedload(Appointment.patient).joinedload(Patient.user),
+        joinedload(Appointment.doctor).joinedload(Doctor.user),
+        joinedload(Appointment.doctor).joinedload(Doctor.department)
+    ]
+    if with_treatment:
+        options.append(joinedload(Appointment.treatment))
+
+    return Appointment.query.options(*options)
+
+
+def doctor_query():
+    """Doctor query with user and department loaded in the same SELECT"""
+    return Doctor.query.options(
+        joinedload(Doctor.user),
+        joinedload(Doctor.department)
+    )
+
+
+def patient_query():
+    """Patient query with user loaded in the same SELECT"""
+    return Patient.query.options(joinedload(Patient.user))
+
+
+# ============= SERIALIZATION =============
+def _treatment_field(attr, default='N/A'):
+    return lambda apt: getattr(apt.treatment, attr) if apt.treatment else default
+
+
+def _format_date(value):
+    return value.strftime('%Y-%m-%d') if value else None
+
+
+APPOINTMENT_FIELDS = {
+    'id': lambda apt: apt.id,
+    'patient_id': lambda apt: apt.patient_id,
+    'patient_name': lambda apt: apt.patient.user.full_name,
+    'doctor_id': lambda apt: apt.doctor_id,
+    'doctor_name': lambda apt: apt.doctor.user.full_name,
+    'department': lambda apt: apt.doctor.department.name,
+    'date': lambda apt: apt.appointment_date.strftime('%Y-%m-%d'),
+    'time': lambda apt: apt.appointment_time.strftime('%H:%M'),
+    'status': lambda apt: apt.status,
+    'reason': lambda apt: apt.reason,
+    'has_treatment': lambda apt: apt.treatment is not None,
+    'diagnosis': _treatment_field('diagnosis'),
+    'prescription': _treatment_field('prescription'),
+    'notes': _treatment_field('notes'),
+    'follow_up_required': _treatment_field('follow_up_required', False),
+    'follow_up_date': lambda apt: _format_date(apt.treatment.follow_up_date) if apt.treatment else None
+}
+
+DOCTOR_FIELDS = {
+    'id': lambda doc: doc.id,
+    'user_id': lambda doc: doc.user.id,
+    'name': lambda doc: doc.user.full_name,
+    'email': lambda doc: doc.user.email,
+    'phone': lambda doc: doc.user.phone,
+    'department': lambda doc: doc.department.name,
+    'qualification': lambda doc: doc.qualification,
+    'experience_years': lambda doc: doc.experience_years,
+    'is_active': lambda doc: doc.is_active
+}
+
+PATIENT_FIELDS = {
+    'id': lambda pat: pat.id,
+    'user_id': lambda pat: pat.user.id,
+    'name': lambda pat: pat.user.full_name,
+    'email': lambda pat: pat.user.email,
+    'phone': lambda pat: pat.user.phone,
+    'blood_group': lambda pat: pat.user.blood_group,
+    'is_active': lambda pat: pat.user.active,
+    'created_at': lambda pat: _format_date(pat.created_at)
+}
+
+
+def _serialize(rows, registry, fields):
+    getters = [(field, registry[field]) for field in fields]
+    return [{field: getter(row) for field, getter in getters} for row in rows]
+
+
+def serialize_appointments(appointments, fields):
+    """Serialize appointments to dicts holding the requested APPOINTMENT_FIELDS"""
+    return _serialize(appointments, APPOINTMENT_FIELDS, fields)
+
+
+def serialize_doctors(doctors, fields):
+    """Serialize doctors to dicts holding the requested DOCTOR_FIELDS"""
+    return _serialize(doctors, DOCTOR_FIELDS, fields)
+
+
+def serialize_patients(patients, fields):
+    """Serialize patients to dicts holding the requested PATIENT_FIELDS"""
+    return _serialize(patients, PATIENT_FIELDS, fields)
+
+
+# ============= KEYSET PAGINATION & STREAMING =============
+def encode_cursor(values):
+    """Opaque cursor for the sort key of the last row on a page"""
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor back into typed values for the given sort columns"""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(raw, list) or len(raw) != len(columns):
+        raise ValueError('Invalid cursor')
+
+    values = []
+    for column, value in zip(columns, raw):
+        python_type = column.type.python_type
+        if python_type in (date, datetime) and value is not None:
+            value = python_type.fromisoformat(value)
+        values.append(value)
+    return values
+
+
+def apply_keyset(query, columns, cursor=None, descending=False):
+    """Order a query by a (sort column, unique id) pair and seek past the cursor"""
+    sort_column, id_column = columns
+
+    if cursor:
+        sort_value, id_value = decode_cursor(cursor, columns)
+        if descending:
+            query = query.filter(or_(
+                sort_column < sort_value,
+                and_(sort_column == sort_value, id_column < id_value)
+            ))
+        else:
+            query = query.filter(or_(
+                sort_column > sort_value,
+                and_(sort_column == sort_value, id_column > id_value)
+            ))
+
+    if descending:
+        return query.order_by(sort_column.desc(), id_column.desc())
+    return query.order_by(sort_column.asc(), id_column.asc())
+
+
+def keyset_page(query, columns, cursor=None, limit=50, descending=False):
+    """Fetch one page of rows and the cursor for the next page (None on the last page)"""
+    rows = apply_keyset(query, columns, cursor, descending).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+
+    return rows, next_cursor
+
+
+def ndjson_response(query, serializer, fields, columns, cursor=None, limit=None, descending=False):
+    """Stream query rows as newline-delimited JSON without materializing the result set.
+
+    Honours the same cursor/limit as keyset_page; when rows remain past the limit the
+    cursor for the next chunk is sent in the X-Next-Cursor header.
+    """
+    query = apply_keyset(query, columns, cursor, descending)
+    headers = {}
+
+    if limit:
+        # Probe the keyset columns around the boundary (an index-only read) so the
+        # next cursor is known before the body starts streaming
+        boundary = query.with_entities(*columns).offset(limit - 1).limit(2).all()
+        if len(boundary) == 2:
+            headers['X-Next-Cursor'] = encode_cursor(list(boundary[0]))
+        query = query.limit(limit)
+
+    def generate():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield json.dumps(serializer([row], fields)[0]) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
@@ -0,0 +1,193 @@
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Doctor, Department, Appointment, DoctorAvailability, SlotCapacity
+from datetime import datetime, timedelta
+import heapq
+
+# Length of a bookable appointment slot
+SLOT_MINUTES = 30
+
+
+def generate_slot_times(availability):
+    """Yield every slot start time within an availability window"""
+    current_time = datetime.combine(availability.date, availability.start_time)
+    end_time = datetime.combine(availability.date, availability.end_time)
+
+    while current_time < end_time:
+        yield current_time.time()
+        current_time += timedelta(minutes=SLOT_MINUTES)
+
+
+def get_booked_counts(doctor_id, selected_date):
+    """Booked appointment count per slot time for a doctor's day (single grouped query)"""
+    rows = db.session.query(
+        Appointment.appointment_time,
+        func.count(Appointment.id)
+    ).filter(
+        Appointment.doctor_id == doctor_id,
+        Appointment.appointment_date == selected_date,
+        Appointment.status == 'Booked'
+    ).group_by(Appointment.appointment_time).all()
+
+    return {slot_time: count for slot_time, count in rows}
+
+
+def get_slot_occupancy(doctor_id, selected_date):
+    """Return every slot of a doctor's day with its booked count and remaining capacity"""
+    availability = DoctorAvailability.query.filter_by(
+        doctor_id=doctor_id,
+        date=selected_date,
+        is_available=True
+    ).first()
+
+    if not availability:
+        return []
+
+    booked_counts = get_booked_counts(doctor_id, selected_date)
+
+    slots = []
+    for slot_time in generate_slot_times(availability):
+        booked = booked_counts.get(slot_time, 0)
+        slots.append({
+            'time': slot_time,
+            'booked': booked,
+            'remaining': max(availability.max_patients - booked, 0)
+        })
+
+    return slots
+
+
+def find_open_slots(start_date, end_date, doctor_ids=None, department_id=None, limit=10):
+    """Earliest open slots across several doctors and days using set-based queries"""
+    windows_query = db.session.query(
+        DoctorAvailability,
+        User.full_name,
+        Department.name
+    ).join(
+        Doctor, Doctor.id == DoctorAvailability.doctor_id
+    ).join(
+        User, User.id == Doctor.user_id
+    ).join(
+        Department, Department.id == Doctor.department_id
+    ).filter(
+        Doctor.is_active == True,
+        DoctorAvailability.is_available == True,
+        DoctorAvailability.date.between(start_date, end_date)
+    )
+
+    if doctor_ids:
+        windows_query = windows_query.filter(DoctorAvailability.doctor_id.in_(doctor_ids))
+    if department_id:
+        windows_query = windows_query.filter(Doctor.department_id == department_id)
+
+    windows = windows_query.all()
+    if not windows:
+        return []
+
+    # Booked counts for every (doctor, date, time) in the range in one grouped query
+    window_doctor_ids = {availability.doctor_id for availability, _, _ in windows}
+    booked_rows = db.session.query(
+        Appointment.doctor_id,
+        Appointment.appointment_date,
+        Appointment.appointment_time,
+        func.count(Appointment.id)
+    ).filter(
+        Appointment.doctor_id.in_(window_doctor_ids),
+        Appointment.appointment_date.between(start_date, end_date),
+        Appointment.status == 'Booked'
+    ).group_by(
+        Appointment.doctor_id,
+        Appointment.appointment_date,
+        Appointment.appointment_time
+    ).all()
+
+    booked_counts = {(doc_id, apt_date, apt_time): count for doc_id, apt_date, apt_time, count in booked_rows}
+
+    def open_slots():
+        for availability, doctor_name, department_name in windows:
+            for slot_time in generate_slot_times(availability):
+                booked = booked_counts.get((availability.doctor_id, availability.date, slot_time), 0)
+                remaining = availability.max_patients - booked
+                if remaining > 0:
+                    yield (availability.date, slot_time, availability.doctor_id, {
+                        'doctor_id': availability.doctor_id,
+                        'doctor_name': doctor_name,
+                        'department': department_name,
+                        'date': availability.date,
+                        'time': slot_time,
+                        'remaining': remaining
+                    })
+
+    earliest = heapq.nsmallest(limit, open_slots(), key=lambda item: item[:3])
+    return [slot for _, _, _, slot in earliest]
+
+
+def _ensure_slot_counter(doctor_id, slot_date, slot_time):
+    """Create the capacity counter for a slot if missing, seeded from existing bookings"""
+    booked_count = select(func.count(Appointment.id)).where(
+        Appointment.doctor_id == doctor_id,
+        Appointment.appointment_date == slot_date,
+        Appointment.appointment_time == slot_time,
+        Appointment.status == 'Booked'
+    ).scalar_subquery()
+
+    values = {
+        'doctor_id': doctor_id,
+        'slot_date': slot_date,
+        'slot_time': slot_time,
+        'booked_count': booked_count
+    }
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        db.session.execute(
+            insert(SlotCapacity).values(**values).on_conflict_do_nothing(
+                index_elements=['doctor_id', 'slot_date', 'slot_time']
+            )
+        )
+        return
+
+    # Other backends: let the unique constraint arbitrate concurrent creators
+    try:
+        with db.session.begin_nested():
+            db.session.execute(SlotCapacity.__table__.insert().values(**values))
+    except IntegrityError:
+        pass
+
+
+def reserve_slot(doctor_id, slot_date, slot_time, max_patients):
+    """Atomically take one place in a slot; returns False when the slot is full"""
+    _ensure_slot_counter(doctor_id, slot_date, slot_time)
+
+    # Conditional UPDATE: the row lock serializes only bookings for this slot
+    result = db.session.execute(
+        update(SlotCapacity).where(
+            SlotCapacity.doctor_id == doctor_id,
+            SlotCapacity.slot_date == slot_date,
+            SlotCapacity.slot_time == slot_time,
+            SlotCapacity.booked_count < max_patients
+        ).values(
+            booked_count=SlotCapacity.booked_count + 1
+        ).execution_options(synchronize_session=False)
+    )
+
+    return result.rowcount == 1
+
+
+def release_slot(appointment):
+    """Give back the place held by a booked appointment (cancel/complete)"""
+    db.session.execute(
+        update(SlotCapacity).where(
+            SlotCapacity.doctor_id == appointment.doctor_id,
+            SlotCapacity.slot_date == appointment.appointment_date,
+            SlotCapacity.slot_time == appointment.appointment_time,
+            SlotCapacity.booked_count > 0
+        ).values(
+            booked_count=SlotCapacity.booked_count - 1
+        ).execution_options(synchronize_session=False)
+    )
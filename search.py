@@ -0,0 +1,113 @@
+from sqlalchemy import text
+from models import db
+import sqlite3
+
+# SQLite FTS5 index over user name/email/phone, kept in sync by triggers on the user table.
+# The trigram tokenizer gives indexed substring matching (what ilike('%q%') did with a scan).
+SEARCH_TABLE = 'user_search'
+
+# Minimum query length the trigram index can answer
+MIN_INDEXED_LENGTH = 3
+
+# The FTS5 trigram tokenizer first shipped in SQLite 3.34.0
+TRIGRAM_MIN_SQLITE_VERSION = (3, 34, 0)
+
+_SEARCH_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        full_name, email, phone,
+        content='user', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON "user" BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, full_name, email, phone)
+        VALUES (new.id, new.full_name, new.email, new.phone);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON "user" BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, full_name, email, phone)
+        VALUES ('delete', old.id, old.full_name, old.email, old.phone);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au AFTER UPDATE OF full_name, email, phone ON "user" BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, full_name, email, phone)
+        VALUES ('delete', old.id, old.full_name, old.email, old.phone);
+        INSERT INTO {SEARCH_TABLE}(rowid, full_name, email, phone)
+        VALUES (new.id, new.full_name, new.email, new.phone);
+    END
+    """
+]
+
+
+def search_index_available(engine=None):
+    """The FTS index needs SQLite 3.34+ for trigrams; anything else falls back to ilike"""
+    engine = engine or db.engine
+    return engine.dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= TRIGRAM_MIN_SQLITE_VERSION
+
+
+def ensure_search_index(engine):
+    """Create the FTS table and sync triggers, building the index on first run"""
+    if not search_index_available(engine):
+        return
+
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': SEARCH_TABLE}
+        ).first()
+
+        for statement in _SEARCH_DDL:
+            conn.execute(text(statement))
+
+        if not exists:
+            conn.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def build_match(query, columns):
+    """FTS5 expressions for a query: every term as a substring, then any shared trigram (fuzzy)"""
+    terms = [term for term in query.lower().split() if len(term) >= MIN_INDEXED_LENGTH]
+    if not terms:
+        return None, None
+
+    column_filter = '{' + ' '.join(columns) + '}'
+    exact = f'{column_filter} : (' + ' AND '.join(_quote(term) for term in terms) + ')'
+
+    grams = set()
+    for term in terms:
+        grams |= _trigrams(term)
+    fuzzy = f'{column_filter} : (' + ' OR '.join(_quote(gram) for gram in sorted(grams)) + ')'
+
+    return exact, fuzzy
+
+
+def search_profile_ids(profile_table, query, columns, limit):
+    """Ranked doctor/patient ids whose user matches the query, best match first"""
+    exact, fuzzy = build_match(query, columns)
+    if not exact:
+        return None
+
+    statement = text(f"""
+        SELECT p.id FROM {SEARCH_TABLE} s
+        JOIN {profile_table} p ON p.user_id = s.rowid
+        WHERE {SEARCH_TABLE} MATCH :match
+        ORDER BY s.rank
+        LIMIT :limit
+    """)
+
+    ids = [row[0] for row in db.session.execute(statement, {'match': exact, 'limit': limit})]
+    if not ids:
+        # Typo tolerance: rank users by how many query trigrams they share
+        ids = [row[0] for row in db.session.execute(statement, {'match': fuzzy, 'limit': limit})]
+
+    return ids
@@ -0,0 +1,137 @@
+from sqlalchemy import func, delete, update, text
+from sqlalchemy.exc import IntegrityError
+from models import db, Doctor, Patient, Appointment, StatCounter
+from datetime import datetime
+
+# Counter keys
+PATIENTS = 'patients'
+ACTIVE_DOCTORS = 'doctors:active'
+APPOINTMENTS = 'appointments'
+
+
+def appointments_on(day):
+    return f'appointments:day:{day.isoformat()}'
+
+
+def appointments_with_status(status):
+    return f'appointments:status:{status}'
+
+
+def appointments_in_department(department_id):
+    return f'appointments:department:{department_id}'
+
+
+def increment(key, delta=1):
+    """Add delta to a counter inside the caller's transaction, creating it if missing"""
+    now = datetime.utcnow()
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        stmt = insert(StatCounter).values(key=key, value=delta, updated_at=now)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'value': StatCounter.value + delta, 'updated_at': now}
+        ))
+        return
+
+    result = db.session.execute(
+        update(StatCounter).where(StatCounter.key == key).values(
+            value=StatCounter.value + delta, updated_at=now
+        ).execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(StatCounter.__table__.insert().values(key=key, value=delta, updated_at=now))
+        except IntegrityError:
+            increment(key, delta)
+
+
+def apply_counters(deltas):
+    """Apply counter deltas inside the caller's transaction, so they commit or roll back with the change"""
+    # Fixed key order so concurrent writers cannot deadlock on the counter rows
+    for key in sorted(deltas):
+        if deltas[key]:
+            increment(key, deltas[key])
+
+
+def booking_deltas(appointment_date, department_id):
+    """Counter deltas for a new booking: total, per-day, per-status and per-department"""
+    return {
+        APPOINTMENTS: 1,
+        appointments_on(appointment_date): 1,
+        appointments_with_status('Booked'): 1,
+        appointments_in_department(department_id): 1
+    }
+
+
+def status_change_deltas(old_status, new_status):
+    """Counter deltas moving an appointment between per-status counters"""
+    if old_status == new_status:
+        return {}
+    return {appointments_with_status(old_status): -1, appointments_with_status(new_status): 1}
+
+
+def get_counters(*keys):
+    """Current values for the given counter keys (0 when a counter does not exist yet)"""
+    rows = db.session.query(StatCounter.key, StatCounter.value).filter(StatCounter.key.in_(keys)).all()
+    values = dict(rows)
+    return {key: values.get(key, 0) for key in keys}
+
+
+def _lock_counters():
+    """Hold the write lock on stat_counter from before the counts until the replace commits"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('LOCK TABLE stat_counter IN EXCLUSIVE MODE'))
+    # On SQLite the delete is the transaction's first write, which takes the database write lock
+    db.session.execute(delete(StatCounter))
+
+
+def rebuild_counters():
+    """Recompute every counter from the source tables in one transaction (reconciliation)"""
+    # Start a fresh transaction and lock first, so no increment can commit between
+    # the counts below and the replace (it would be overwritten and lost)
+    db.session.commit()
+    _lock_counters()
+
+    counters = {
+        PATIENTS: Patient.query.count(),
+        ACTIVE_DOCTORS: Doctor.query.filter_by(is_active=True).count(),
+        APPOINTMENTS: Appointment.query.count()
+    }
+
+    for day, count in db.session.query(
+        Appointment.appointment_date, func.count(Appointment.id)
+    ).group_by(Appointment.appointment_date):
+        counters[appointments_on(day)] = count
+
+    for status, count in db.session.query(
+        Appointment.status, func.count(Appointment.id)
+    ).group_by(Appointment.status):
+        counters[appointments_with_status(status)] = count
+
+    for department_id, count in db.session.query(
+        Doctor.department_id, func.count(Appointment.id)
+    ).join(Appointment, Appointment.doctor_id == Doctor.id).group_by(Doctor.department_id):
+        counters[appointments_in_department(department_id)] = count
+
+    now = datetime.utcnow()
+    if counters:
+        db.session.execute(
+            StatCounter.__table__.insert(),
+            [{'key': key, 'value': value, 'updated_at': now} for key, value in counters.items()]
+        )
+    db.session.commit()
+
+    return len(counters)
+
+
+def ensure_counters():
+    """Build the counters on first start against an existing database"""
+    if not db.session.query(StatCounter.id).first():
+        rebuild_counters()
@@ -1,268 +1,437 @@
 from celery import shared_task
 from datetime import datetime, date, timedelta
-import csv
 import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import time
+from mailer import build_message, get_transport
+from task_metrics import record_items, record_emails, record_run_completion
 
-# Email Configuration
-SMTP_SERVER_HOST = "localhost"  # Change to your SMTP server
-SMTP_SERVER_PORT = 1025  # Mailhog default port
-SENDER_ADDRESS = "hospital@noreply.com"
-SENDER_PASSWORD = ""
+# Tasks run inside the Flask app context pushed by FlaskTask (see celery_init_app in app.py),
+# so the worker imports the app once at startup instead of once per task call
 
+# Reminders handled per subtask in the daily fan-out
+REMINDER_BATCH_SIZE = 100
 
-def send_email(to_address, subject, message, content="html", attachment_file=None):
-    """Send email with optional attachment"""
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = SENDER_ADDRESS
-        msg['To'] = to_address
-        msg['Subject'] = subject
+# Delivery ledger notification type for the daily reminder
+DAILY_REMINDER = 'daily_reminder'
 
-        if content == "html":
-            msg.attach(MIMEText(message, "html"))
-        else:
-            msg.attach(MIMEText(message, "plain"))
+# A 'queued' or 'sending' ledger entry older than this is treated as lost and re-sent
+STALE_CLAIM_AFTER = timedelta(hours=2)
+
+# Deliveries are given up after this many attempts (permanently failing addresses)
+MAX_REMINDER_ATTEMPTS = 3
 
-        if attachment_file and os.path.exists(attachment_file):
-            with open(attachment_file, 'rb') as attachment:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment.read())
-            
-            encoders.encode_base64(part)
-            filename = os.path.basename(attachment_file)
-            part.add_header("Content-Disposition", f"attachment; filename={filename}")
-            msg.attach(part)
 
-        s = smtplib.SMTP(host=SMTP_SERVER_HOST, port=SMTP_SERVER_PORT)
-        s.login(SENDER_ADDRESS, SENDER_PASSWORD)
-        s.send_message(msg)
-        s.quit()
-        return True
+def send_email(to_address, subject, message, content="html", attachment_file=None):
+    """Send email with optional attachment over the worker's shared SMTP session"""
+    try:
+        msg = build_message(to_address, subject, message, content, attachment_file)
+        sent = get_transport().send(msg)
     except Exception as e:
         print(f"Email sending failed: {e}")
-        return False
+        sent = False
+    
+    record_emails(sent=1 if sent else 0, failed=0 if sent else 1)
+    return sent
+
+
+def render_reminder(reminder):
+    """Render the reminder email body for one appointment payload"""
+    return f"""
+    <html>
+    <body>
+        <h2>Appointment Reminder</h2>
+        <p>Dear {reminder['patient_name']},</p>
+        <p>This is a reminder for your appointment scheduled today:</p>
+        <ul>
+            <li><strong>Doctor:</strong> Dr. {reminder['doctor_name']}</li>
+            <li><strong>Department:</strong> {reminder['department']}</li>
+            <li><strong>Date:</strong> {reminder['date']}</li>
+            <li><strong>Time:</strong> {reminder['time']}</li>
+        </ul>
+        <p>Please arrive 10 minutes before your scheduled time.</p>
+        <p>Best regards,<br>Hospital Management Team</p>
+    </body>
+    </html>
+    """
 
 
 @shared_task(ignore_results=False, name="tasks.send_daily_reminders")
 def send_daily_reminders():
-    """Send daily appointment reminders to patients"""
-    from app import app
-    from models import Appointment, Patient, Doctor
+    """Select today's not-yet-notified reminders in one query and fan them out to batch subtasks"""
+    from models import db, Appointment, NotificationLog
+    from queries import appointment_query
+    from sqlalchemy import and_, or_, insert, update
+    from celery import chord, group
     
-    with app.app_context():
-        today = date.today()
-        
-        # Get all appointments scheduled for today with status 'Booked'
-        appointments = Appointment.query.filter(
-            Appointment.appointment_date == today,
-            Appointment.status == 'Booked'
-        ).all()
+    started_at = time.time()
+    today = date.today()
+    stale_before = datetime.utcnow() - STALE_CLAIM_AFTER
+    
+    # Booked appointments for today with no ledger entry, a retryable failure, or a lost claim
+    pending = appointment_query().outerjoin(
+        NotificationLog,
+        and_(
+            NotificationLog.appointment_id == Appointment.id,
+            NotificationLog.notification_type == DAILY_REMINDER
+        )
+    ).filter(
+        Appointment.appointment_date == today,
+        Appointment.status == 'Booked',
+        or_(
+            NotificationLog.id.is_(None),
+            and_(
+                NotificationLog.attempts < MAX_REMINDER_ATTEMPTS,
+                or_(
+                    NotificationLog.status == 'failed',
+                    and_(NotificationLog.status.in_(('queued', 'sending')), NotificationLog.updated_at < stale_before)
+                )
+            )
+        )
+    ).add_columns(NotificationLog.id).all()
+    
+    if not pending:
+        record_run_completion(send_daily_reminders.name, started_at, items=0, emails_sent=0, emails_failed=0)
+        return "Daily reminders sent: 0"
+    
+    # Claim the appointments before dispatch so the next beat skips them
+    now = datetime.utcnow()
+    new_claims = [
+        {'appointment_id': apt.id, 'notification_type': DAILY_REMINDER, 'status': 'queued',
+         'attempts': 0, 'created_at': now, 'updated_at': now}
+        for apt, log_id in pending if log_id is None
+    ]
+    retry_ids = [log_id for _, log_id in pending if log_id is not None]
+    
+    if new_claims:
+        db.session.execute(insert(NotificationLog), new_claims)
+    if retry_ids:
+        db.session.execute(
+            update(NotificationLog).where(NotificationLog.id.in_(retry_ids)).values(
+                status='queued', updated_at=now
+            ).execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    
+    # Plain payloads so batch workers only touch the ledger
+    reminders = [{
+        'appointment_id': apt.id,
+        'email': apt.patient.user.email,
+        'patient_name': apt.patient.user.full_name,
+        'doctor_name': apt.doctor.user.full_name,
+        'department': apt.doctor.department.name,
+        'date': apt.appointment_date.strftime('%d %B %Y'),
+        'time': apt.appointment_time.strftime('%I:%M %p')
+    } for apt, _ in pending]
+    
+    batches = [reminders[i:i + REMINDER_BATCH_SIZE] for i in range(0, len(reminders), REMINDER_BATCH_SIZE)]
+    
+    # Batches run in parallel across workers; the callback aggregates their results
+    record_items(len(reminders))
+    # The callback receives the start time, so the whole run is timed up to the last batch
+    result = chord(group(send_reminder_batch.s(batch) for batch in batches))(
+        aggregate_reminder_results.s(started_at=started_at)
+    )
+    
+    return f"Daily reminders dispatched: {len(reminders)} in {len(batches)} batches (result {result.id})"
+
+
+@shared_task(ignore_results=False, name="tasks.send_reminder_batch")
+def send_reminder_batch(reminders):
+    """Render and send one batch of reminders over a single SMTP session, recording each delivery"""
+    from models import db, NotificationLog
+    from sqlalchemy import update
+    
+    transport = get_transport()
+    sent_ids = []
+    failed_ids = []
+    skipped = 0
+    
+    for reminder in reminders:
+        # Claim the row just before sending: if it was re-queued to another batch (or
+        # already handled) while this one was slow, only one of them gets to send it
+        claimed = db.session.execute(
+            update(NotificationLog).where(
+                NotificationLog.appointment_id == reminder['appointment_id'],
+                NotificationLog.notification_type == DAILY_REMINDER,
+                NotificationLog.status == 'queued'
+            ).values(
+                status='sending',
+                attempts=NotificationLog.attempts + 1,
+                updated_at=datetime.utcnow()
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
         
-        reminders_sent = 0
+        if not claimed:
+            skipped += 1
+            continue
         
-        for appointment in appointments:
-            patient = Patient.query.get(appointment.patient_id)
-            doctor = Doctor.query.get(appointment.doctor_id)
-            
-            if patient and doctor:
-                patient_user = patient.user
-                doctor_user = doctor.user
-                
-                # Create reminder message
-                message = f"""
-                <html>
-                <body>
-                    <h2>Appointment Reminder</h2>
-                    <p>Dear {patient_user.full_name},</p>
-                    <p>This is a reminder for your appointment scheduled today:</p>
-                    <ul>
-                        <li><strong>Doctor:</strong> Dr. {doctor_user.full_name}</li>
-                        <li><strong>Department:</strong> {doctor.department.name}</li>
-                        <li><strong>Date:</strong> {appointment.appointment_date.strftime('%d %B %Y')}</li>
-                        <li><strong>Time:</strong> {appointment.appointment_time.strftime('%I:%M %p')}</li>
-                    </ul>
-                    <p>Please arrive 10 minutes before your scheduled time.</p>
-                    <p>Best regards,<br>Hospital Management Team</p>
-                </body>
-                </html>
-                """
-                
-                # Send email
-                if send_email(patient_user.email, "Appointment Reminder - Today", message):
-                    reminders_sent += 1
-                    
-                # Optional: Send to Google Chat (if webhook configured)
-                # send_google_chat_reminder(patient_user, appointment)
+        msg = build_message(reminder['email'], "Appointment Reminder - Today", render_reminder(reminder))
+        if transport.send(msg):
+            sent_ids.append(reminder['appointment_id'])
+        else:
+            failed_ids.append(reminder['appointment_id'])
         
-        return f"Daily reminders sent: {reminders_sent}"
+        # Optional: Send to Google Chat (if webhook configured)
+        # send_google_chat_reminder(patient_user, appointment)
+    
+    now = datetime.utcnow()
+    for status, appointment_ids in (('sent', sent_ids), ('failed', failed_ids)):
+        if not appointment_ids:
+            continue
+        db.session.execute(
+            update(NotificationLog).where(
+                NotificationLog.appointment_id.in_(appointment_ids),
+                NotificationLog.notification_type == DAILY_REMINDER,
+                NotificationLog.status == 'sending'
+            ).values(
+                status=status,
+                sent_at=now if status == 'sent' else None,
+                updated_at=now
+            ).execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    
+    record_items(len(reminders) - skipped)
+    record_emails(sent=len(sent_ids), failed=len(failed_ids))
+    return {'sent': len(sent_ids), 'failed': len(failed_ids), 'skipped': skipped}
+
+
+@shared_task(ignore_results=False, name="tasks.aggregate_reminder_results")
+def aggregate_reminder_results(results, started_at=None):
+    """Combine batch results into the daily reminder summary and record the end-to-end run"""
+    sent = sum(result['sent'] for result in results)
+    failed = sum(result['failed'] for result in results)
+    
+    if started_at is not None:
+        record_run_completion(send_daily_reminders.name, started_at, items=sent + failed, emails_sent=sent, emails_failed=failed)
+    
+    return f"Daily reminders sent: {sent} (failed: {failed})"
 
 
 @shared_task(ignore_results=False, name="tasks.send_monthly_reports")
 def send_monthly_reports():
-    """Send monthly activity reports to doctors"""
-    from app import app
-    
-    with app.app_context():
-        # Get first and last day of previous month
-        today = date.today()
-        first_day_this_month = date(today.year, today.month, 1)
-        last_day_prev_month = first_day_this_month - timedelta(days=1)
-        first_day_prev_month = date(last_day_prev_month.year, last_day_prev_month.month, 1)
-        
-        doctors = Doctor.query.filter_by(is_active=True).all()
-        reports_sent = 0
-        
-        for doctor in doctors:
-            # Get appointments for this doctor in previous month
-            appointments = Appointment.query.filter(
-                Appointment.doctor_id == doctor.id,
-                Appointment.appointment_date >= first_day_prev_month,
-                Appointment.appointment_date <= last_day_prev_month
-            ).all()
-            
-            if not appointments:
-                continue
-            
-            # Calculate statistics
-            total_appointments = len(appointments)
-            completed = len([a for a in appointments if a.status == 'Completed'])
-            cancelled = len([a for a in appointments if a.status == 'Cancelled'])
-            
-            # Create HTML report
-            message = f"""
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; }}
-                    table {{ border-collapse: collapse; width: 100%; }}
-                    th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                    th {{ background-color: #4CAF50; color: white; }}
-                </style>
-            </head>
-            <body>
-                <h2>Monthly Activity Report - {last_day_prev_month.strftime('%B %Y')}</h2>
-                <p>Dear Dr. {doctor.user.full_name},</p>
-                
-                <h3>Summary</h3>
-                <ul>
-                    <li><strong>Total Appointments:</strong> {total_appointments}</li>
-                    <li><strong>Completed:</strong> {completed}</li>
-                    <li><strong>Cancelled:</strong> {cancelled}</li>
-                </ul>
-                
-                <h3>Appointment Details</h3>
-                <table>
-                    <tr>
-                        <th>Date</th>
-                        <th>Patient</th>
-                        <th>Status</th>
-                        <th>Diagnosis</th>
-                    </tr>
-            """
-            
-            for apt in appointments:
-                patient_name = apt.patient.user.full_name
-                diagnosis = apt.treatment.diagnosis if apt.treatment else "N/A"
-                message += f"""
-                    <tr>
-                        <td>{apt.appointment_date.strftime('%d-%m-%Y')}</td>
-                        <td>{patient_name}</td>
-                        <td>{apt.status}</td>
-                        <td>{diagnosis[:50]}...</td>
-                    </tr>
-                """
-            
-            message += """
-                </table>
-                <p>Thank you for your dedication!</p>
-                <p>Best regards,<br>Hospital Management Team</p>
-            </body>
-            </html>
-            """
-            
-            subject = f"Monthly Report - {last_day_prev_month.strftime('%B %Y')}"
-            if send_email(doctor.user.email, subject, message):
-                reports_sent += 1
-        
-        return f"Monthly reports sent to {reports_sent} doctors"
+    """Compute per-doctor monthly stats in one grouped query and render reports in parallel"""
+    from models import db, User, Doctor, Appointment
+    from sqlalchemy import func, case
+    from celery import chord, group
+    
+    started_at = time.time()
+    
+    # Get first and last day of previous month
+    today = date.today()
+    first_day_this_month = date(today.year, today.month, 1)
+    last_day_prev_month = first_day_this_month - timedelta(days=1)
+    first_day_prev_month = date(last_day_prev_month.year, last_day_prev_month.month, 1)
+    
+    # Totals per active doctor with at least one appointment last month
+    stats = db.session.query(
+        Doctor.id,
+        User.full_name,
+        User.email,
+        func.count(Appointment.id),
+        func.sum(case((Appointment.status == 'Completed', 1), else_=0)),
+        func.sum(case((Appointment.status == 'Cancelled', 1), else_=0))
+    ).join(
+        Appointment, Appointment.doctor_id == Doctor.id
+    ).join(
+        User, User.id == Doctor.user_id
+    ).filter(
+        Doctor.is_active == True,
+        Appointment.appointment_date.between(first_day_prev_month, last_day_prev_month)
+    ).group_by(Doctor.id, User.id).all()
+    
+    if not stats:
+        record_run_completion(send_monthly_reports.name, started_at, items=0, emails_sent=0, emails_failed=0)
+        return "Monthly reports sent to 0 doctors"
+    
+    reports = [{
+        'doctor_id': doctor_id,
+        'doctor_name': full_name,
+        'email': email,
+        'total': total,
+        'completed': completed,
+        'cancelled': cancelled,
+        'start': first_day_prev_month.isoformat(),
+        'end': last_day_prev_month.isoformat()
+    } for doctor_id, full_name, email, total, completed, cancelled in stats]
+    
+    record_items(len(reports))
+    result = chord(group(send_doctor_report.s(report) for report in reports))(
+        aggregate_report_results.s(started_at=started_at)
+    )
+    
+    return f"Monthly reports dispatched: {len(reports)} doctors (result {result.id})"
 
 
-@shared_task(ignore_results=False, name="tasks.export_treatment_csv")
-def export_treatment_csv(patient_id):
-    """Export patient's treatment history as CSV"""
-    from app import app
-    
-    with app.app_context():
-        patient = Patient.query.get(patient_id)
-        if not patient:
-            return {"success": False, "message": "Patient not found"}
-        
-        # Get all completed appointments with treatments
-        appointments = Appointment.query.filter(
-            Appointment.patient_id == patient_id,
-            Appointment.status == 'Completed'
-        ).order_by(Appointment.appointment_date.desc()).all()
-        
-        # Create CSV file
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"treatment_history_{patient_id}_{timestamp}.csv"
-        filepath = os.path.join('static', filename)
-        
-        # Ensure static directory exists
-        os.makedirs('static', exist_ok=True)
-        
-        with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = [
-                'Appointment Date', 
-                'Doctor Name', 
-                'Department', 
-                'Diagnosis', 
-                'Prescription', 
-                'Notes', 
-                'Follow-up Required',
-                'Follow-up Date'
-            ]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            for apt in appointments:
-                doctor = Doctor.query.get(apt.doctor_id)
-                treatment = apt.treatment
-                
-                writer.writerow({
-                    'Appointment Date': apt.appointment_date.strftime('%d-%m-%Y'),
-                    'Doctor Name': f"Dr. {doctor.user.full_name}",
-                    'Department': doctor.department.name,
-                    'Diagnosis': treatment.diagnosis if treatment else 'N/A',
-                    'Prescription': treatment.prescription if treatment else 'N/A',
-                    'Notes': treatment.notes if treatment else 'N/A',
-                    'Follow-up Required': 'Yes' if (treatment and treatment.follow_up_required) else 'No',
-                    'Follow-up Date': treatment.follow_up_date.strftime('%d-%m-%Y') if (treatment and treatment.follow_up_date) else 'N/A'
-                })
-        
-        # Send notification email to patient
-        message = f"""
+@shared_task(ignore_results=False, name="tasks.send_doctor_report")
+def send_doctor_report(report):
+    """Render one doctor's monthly report from streamed detail rows and send it"""
+    from models import Patient, Appointment
+    from queries import STREAM_BATCH_SIZE
+    from sqlalchemy.orm import joinedload
+    
+    first_day = date.fromisoformat(report['start'])
+    last_day = date.fromisoformat(report['end'])
+    
+    # Create HTML report
+    parts = [f"""
         <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; }}
+                table {{ border-collapse: collapse; width: 100%; }}
+                th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
+                th {{ background-color: #4CAF50; color: white; }}
+            </style>
+        </head>
         <body>
-            <h2>Treatment History Export</h2>
-            <p>Dear {patient.user.full_name},</p>
-            <p>Your treatment history has been successfully exported.</p>
-            <p>The CSV file is ready for download.</p>
+            <h2>Monthly Activity Report - {last_day.strftime('%B %Y')}</h2>
+            <p>Dear Dr. {report['doctor_name']},</p>
+            
+            <h3>Summary</h3>
+            <ul>
+                <li><strong>Total Appointments:</strong> {report['total']}</li>
+                <li><strong>Completed:</strong> {report['completed']}</li>
+                <li><strong>Cancelled:</strong> {report['cancelled']}</li>
+            </ul>
+            
+            <h3>Appointment Details</h3>
+            <table>
+                <tr>
+                    <th>Date</th>
+                    <th>Patient</th>
+                    <th>Status</th>
+                    <th>Diagnosis</th>
+                </tr>
+        """]
+    
+    # Detail rows with patient and treatment loaded alongside, fetched in chunks
+    appointments = Appointment.query.options(
+        joinedload(Appointment.patient).joinedload(Patient.user),
+        joinedload(Appointment.treatment)
+    ).filter(
+        Appointment.doctor_id == report['doctor_id'],
+        Appointment.appointment_date.between(first_day, last_day)
+    ).order_by(Appointment.appointment_date).yield_per(STREAM_BATCH_SIZE)
+    
+    for apt in appointments:
+        record_items(1)
+        patient_name = apt.patient.user.full_name
+        diagnosis = apt.treatment.diagnosis if apt.treatment else "N/A"
+        parts.append(f"""
+                <tr>
+                    <td>{apt.appointment_date.strftime('%d-%m-%Y')}</td>
+                    <td>{patient_name}</td>
+                    <td>{apt.status}</td>
+                    <td>{diagnosis[:50]}...</td>
+                </tr>
+            """)
+    
+    parts.append("""
+            </table>
+            <p>Thank you for your dedication!</p>
             <p>Best regards,<br>Hospital Management Team</p>
         </body>
         </html>
-        """
-        
-        send_email(patient.user.email, "Treatment History Export Ready", message)
-        
+        """)
+    
+    subject = f"Monthly Report - {last_day.strftime('%B %Y')}"
+    return send_email(report['email'], subject, ''.join(parts))
+
+
+@shared_task(ignore_results=False, name="tasks.aggregate_report_results")
+def aggregate_report_results(results, started_at=None):
+    """Combine per-doctor send results into the monthly summary and record the end-to-end run"""
+    sent = sum(1 for result in results if result)
+    
+    if started_at is not None:
+        record_run_completion(send_monthly_reports.name, started_at, items=len(results), emails_sent=sent, emails_failed=len(results) - sent)
+    
+    return f"Monthly reports sent to {sent} doctors"
+
+
+@shared_task(ignore_results=False, name="tasks.export_treatment_csv")
+def export_treatment_csv(patient_id, compress=False):
+    """Export patient's treatment history as CSV (optionally gzip-compressed)"""
+    from models import Patient
+    from exports import EXPORT_DIR, write_treatment_csv, export_version, export_filename, remove_superseded_exports, evict_exports
+    
+    patient = Patient.query.get(patient_id)
+    if not patient:
+        return {"success": False, "message": "Patient not found"}
+    
+    # Artifacts are named by data version, so an unchanged history is never regenerated
+    version = export_version(patient_id)
+    filename = export_filename(patient_id, version, compress)
+    filepath = os.path.join(EXPORT_DIR, filename)
+    
+    if os.path.exists(filepath):
         return {
-            "success": True, 
+            "success": True,
             "filename": filename,
             "filepath": filepath,
-            "message": "CSV export completed successfully"
-        }
\ No newline at end of file
+            "message": "CSV export already up to date"
+        }
+    
+    # Stream completed appointments straight from the cursor into the file
+    rows = write_treatment_csv(filepath, patient_id, compress)
+    record_items(rows)
+    remove_superseded_exports(patient_id, version)
+    evict_exports()
+    
+    # Send notification email to patient
+    message = f"""
+    <html>
+    <body>
+        <h2>Treatment History Export</h2>
+        <p>Dear {patient.user.full_name},</p>
+        <p>Your treatment history has been successfully exported.</p>
+        <p>The CSV file is ready for download.</p>
+        <p>Best regards,<br>Hospital Management Team</p>
+    </body>
+    </html>
+    """
+    
+    send_email(patient.user.email, "Treatment History Export Ready", message)
+    
+    return {
+        "success": True, 
+        "filename": filename,
+        "filepath": filepath,
+        "rows": rows,
+        "message": "CSV export completed successfully"
+    }
+
+
+@shared_task(ignore_results=False, name="tasks.evict_export_artifacts")
+def evict_export_artifacts():
+    """Apply the age/size eviction policy to the export directory"""
+    from exports import evict_exports
+    
+    removed = evict_exports()
+    record_items(removed)
+    return f"Export artifacts evicted: {removed}"
+
+
+@shared_task(ignore_results=False, name="tasks.reconcile_stat_counters")
+def reconcile_stat_counters():
+    """Rebuild the dashboard counters from the source tables, correcting any drift"""
+    from stats import rebuild_counters
+    
+    rebuilt = rebuild_counters()
+    record_items(rebuilt)
+    return f"Stat counters rebuilt: {rebuilt}"
+
+
+@shared_task(ignore_results=False, name="tasks.refresh_analytics_rollups")
+def refresh_analytics_rollups(full=False):
+    """Fold appointment/treatment changes since the last run into the analytics rollups"""
+    from analytics import refresh_rollups
+    from caching import bump
+    
+    refreshed = refresh_rollups(full=full)
+    record_items(refreshed)
+    if refreshed:
+        bump('analytics')
+    return f"Analytics rollups refreshed: {refreshed} days"
@@ -0,0 +1,212 @@
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from caching import cache
+from datetime import datetime
+import threading
+import time
+
+# Per-task-name totals kept in the shared cache (Redis in production) with atomic
+# increments, so every worker contributes to the same figures. Durations are in ms.
+COUNTER_FIELDS = (
+    'runs', 'failures', 'runtime_ms', 'queue_wait_ms', 'queue_wait_runs',
+    'items', 'emails_sent', 'emails_failed', 'sql_statements'
+)
+
+_app = None
+_local = threading.local()
+
+
+def _stack():
+    # Eager chords run subtasks inside their parent, so runs nest
+    if not hasattr(_local, 'runs'):
+        _local.runs = []
+    return _local.runs
+
+
+def _current():
+    runs = _stack()
+    return runs[-1] if runs else None
+
+
+def record_items(count):
+    """Count items (reminders, doctors, rows...) processed by the running task"""
+    run = _current()
+    if run is not None:
+        run['items'] += count
+
+
+def record_emails(sent=0, failed=0):
+    """Count emails sent and failed by the running task"""
+    run = _current()
+    if run is not None:
+        run['emails_sent'] += sent
+        run['emails_failed'] += failed
+
+
+def _field_key(task_name, field):
+    return f'task_metrics:{task_name}:{field}'
+
+
+def _run_key(job_name, field):
+    return f'task_metrics:run:{job_name}:{field}'
+
+
+def record_run_completion(job_name, started_at, **details):
+    """Record one end-to-end run of a fanned-out job, from the coordinator starting
+    (started_at, a time.time() value passed through the chord) to its last batch finishing"""
+    finished_at = time.time()
+    elapsed_ms = max(0, int((finished_at - started_at) * 1000))
+    last = {
+        'started_ts': started_at,
+        'finished_ts': finished_at,
+        'started_at': datetime.utcfromtimestamp(started_at).isoformat(),
+        'finished_at': datetime.utcfromtimestamp(finished_at).isoformat(),
+        'elapsed_ms': elapsed_ms,
+        **details
+    }
+
+    try:
+        with _app.app_context():
+            cache.cache.inc(_run_key(job_name, 'runs'), 1)
+            cache.cache.inc(_run_key(job_name, 'elapsed_ms'), elapsed_ms)
+            cache.set(_run_key(job_name, 'last'), last, timeout=0)
+    except Exception as e:
+        print(f"Run metrics not recorded for {job_name}: {e}")
+
+
+# ============= SIGNAL HANDLERS =============
+def _stamp_publish_time(headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+def _queue_wait_ms(task):
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is None:
+        published_at = (getattr(task.request, 'headers', None) or {}).get('published_at')
+    if published_at is None:
+        return None  # eager calls never went through the broker
+    return max(0, int((time.time() - published_at) * 1000))
+
+
+def _start_run(task_id=None, task=None, **kwargs):
+    _stack().append({
+        'task_id': task_id,
+        'start': time.perf_counter(),
+        'queue_wait_ms': _queue_wait_ms(task),
+        'items': 0,
+        'emails_sent': 0,
+        'emails_failed': 0,
+        'sql_statements': 0
+    })
+
+
+def _finish_run(task_id=None, task=None, state=None, **kwargs):
+    runs = _stack()
+    if not runs or runs[-1]['task_id'] != task_id:
+        return
+    run = runs.pop()
+
+    runtime_ms = int((time.perf_counter() - run['start']) * 1000)
+    increments = {
+        'runs': 1,
+        'failures': 1 if state == 'FAILURE' else 0,
+        'runtime_ms': runtime_ms,
+        'items': run['items'],
+        'emails_sent': run['emails_sent'],
+        'emails_failed': run['emails_failed'],
+        'sql_statements': run['sql_statements']
+    }
+    if run['queue_wait_ms'] is not None:
+        increments['queue_wait_ms'] = run['queue_wait_ms']
+        increments['queue_wait_runs'] = 1
+
+    last = {
+        'task_id': task_id,
+        'state': state,
+        'finished_at': datetime.utcnow().isoformat(),
+        'runtime_ms': runtime_ms,
+        'queue_wait_ms': run['queue_wait_ms'],
+        'items': run['items'],
+        'items_per_second': round(run['items'] / (runtime_ms / 1000), 2) if runtime_ms else None,
+        'emails_sent': run['emails_sent'],
+        'emails_failed': run['emails_failed'],
+        'sql_statements': run['sql_statements']
+    }
+
+    try:
+        with _app.app_context():
+            backend = cache.cache
+            for field, amount in increments.items():
+                if amount:
+                    backend.inc(_field_key(task.name, field), amount)
+            cache.set(_field_key(task.name, 'last'), last, timeout=0)
+    except Exception as e:
+        # Metrics must never fail the task itself
+        print(f"Task metrics not recorded for {task.name}: {e}")
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    run = _current()
+    if run is not None:
+        run['sql_statements'] += 1
+
+
+def init_task_metrics(app):
+    """Record runtime, throughput, email, queue-wait and SQL figures for every Celery task"""
+    global _app
+    _app = app
+
+    before_task_publish.connect(_stamp_publish_time, weak=False)
+    task_prerun.connect(_start_run, weak=False)
+    task_postrun.connect(_finish_run, weak=False)
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+
+
+# ============= READING =============
+def get_task_metrics(task_names):
+    """Totals, averages and the last run for each task name (call inside an app context)"""
+    keys = [_field_key(name, field) for name in task_names for field in COUNTER_FIELDS + ('last',)]
+    values = iter(cache.get_many(*keys) if keys else [])
+
+    result = {}
+    for name in task_names:
+        totals = {field: int(next(values) or 0) for field in COUNTER_FIELDS}
+        last = next(values)
+        runs = totals['runs']
+
+        result[name] = {
+            'runs': runs,
+            'failures': totals['failures'],
+            'items': totals['items'],
+            'emails_sent': totals['emails_sent'],
+            'emails_failed': totals['emails_failed'],
+            'sql_statements': totals['sql_statements'],
+            'avg_runtime_ms': round(totals['runtime_ms'] / runs, 1) if runs else None,
+            'items_per_second': round(totals['items'] / (totals['runtime_ms'] / 1000), 2) if totals['runtime_ms'] else None,
+            'avg_queue_wait_ms': round(totals['queue_wait_ms'] / totals['queue_wait_runs'], 1) if totals['queue_wait_runs'] else None,
+            'avg_sql_statements': round(totals['sql_statements'] / runs, 1) if runs else None,
+            'last_run': last
+        }
+
+    return result
+
+
+def get_run_metrics(job_names):
+    """End-to-end run count, average elapsed time and last run for each fanned-out job"""
+    keys = [_run_key(name, field) for name in job_names for field in ('runs', 'elapsed_ms', 'last')]
+    values = iter(cache.get_many(*keys) if keys else [])
+
+    result = {}
+    for name in job_names:
+        runs, elapsed_ms, last = int(next(values) or 0), int(next(values) or 0), next(values)
+        result[name] = {
+            'runs': runs,
+            'avg_elapsed_ms': round(elapsed_ms / runs, 1) if runs else None,
+            'last_run': last
+        }
+
+    return result
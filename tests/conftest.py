@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import text
+
+# Point the app at a throwaway file-backed SQLite database (WAL needs a real file)
+# and an in-process cache before app.py reads its configuration. TEST_DATABASE_URL
+# runs the suite against another backend instead, e.g. a local PostgreSQL (its
+# tables are dropped and recreated for every test).
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+USING_SQLITE = os.environ['DATABASE_URL'].startswith('sqlite')
+os.environ['CACHE_TYPE'] = 'SimpleCache'
+os.environ['BCRYPT_ROUNDS'] = '4'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db, user_datastore, init_db  # noqa: E402
+from models import Doctor, Patient, DoctorAvailability  # noqa: E402
+from caching import cache, _local_identities  # noqa: E402
+from search import SEARCH_TABLE  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The app over a freshly initialized database"""
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.session.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+        db.session.commit()
+        init_db()
+        cache.clear()
+        _local_identities.clear()
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def auth_headers(user):
+    return {'Authentication-Token': user.get_auth_token()}
+
+
+def create_doctor(name, department_id=1):
+    user = user_datastore.create_user(
+        username=f'dr_{name}', full_name=f'Dr {name}', email=f'dr_{name}@test.com',
+        password='unused', active=True, roles=['doctor']
+    )
+    db.session.flush()
+    doctor = Doctor(user_id=user.id, department_id=department_id, is_active=True)
+    db.session.add(doctor)
+    db.session.flush()
+    return doctor
+
+
+def create_patient(name):
+    user = user_datastore.create_user(
+        username=name, full_name=name.title(), email=f'{name}@test.com',
+        password='unused', active=True, roles=['patient']
+    )
+    db.session.flush()
+    patient = Patient(user_id=user.id)
+    db.session.add(patient)
+    db.session.flush()
+    return patient
+
+
+def add_availability(doctor, day, start, end, max_patients):
+    db.session.add(DoctorAvailability(
+        doctor_id=doctor.id, date=day, start_time=start, end_time=end,
+        max_patients=max_patients, is_available=True
+    ))
+    db.session.flush()
@@ -0,0 +1,56 @@
+import threading
+from datetime import date, time
+
+from sqlalchemy import text
+
+from conftest import USING_SQLITE, auth_headers, create_doctor, create_patient, add_availability
+from models import db, Appointment, SlotCapacity
+
+THREADS = 20
+MAX_PATIENTS = 3
+SLOT_DATE = date(2030, 1, 7)
+
+
+def test_concurrent_bookings_never_overbook_a_slot(app):
+    with app.app_context():
+        if USING_SQLITE:
+            assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+
+        doctor = create_doctor('stress')
+        add_availability(doctor, SLOT_DATE, time(9), time(10), MAX_PATIENTS)
+        patients = [create_patient(f'patient{i}') for i in range(THREADS)]
+        db.session.commit()
+        doctor_id = doctor.id
+        headers = [auth_headers(patient.user) for patient in patients]
+
+    barrier = threading.Barrier(THREADS)
+    statuses = []
+    statuses_lock = threading.Lock()
+
+    def book(request_headers):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post('/api/patient/appointment/book', headers=request_headers, json={
+            'doctor_id': doctor_id, 'date': SLOT_DATE.isoformat(), 'time': '09:00'
+        })
+        with statuses_lock:
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=book, args=(h,)) for h in headers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(statuses) == [201] * MAX_PATIENTS + [400] * (THREADS - MAX_PATIENTS)
+
+    with app.app_context():
+        booked = Appointment.query.filter_by(
+            doctor_id=doctor_id, appointment_date=SLOT_DATE, appointment_time=time(9), status='Booked'
+        ).count()
+        capacity = SlotCapacity.query.filter_by(
+            doctor_id=doctor_id, slot_date=SLOT_DATE, slot_time=time(9)
+        ).one()
+
+        assert booked == MAX_PATIENTS
+        assert capacity.booked_count == MAX_PATIENTS
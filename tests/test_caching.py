@@ -0,0 +1,47 @@
+from datetime import date, time, timedelta
+
+from sqlalchemy import event
+
+from conftest import auth_headers, create_doctor, create_patient
+from models import db, Appointment
+
+
+def test_doctor_dashboard_invalidated_only_by_its_own_patients(app, client):
+    with app.app_context():
+        doctor = create_doctor('cached')
+        patient = create_patient('cachedpat')
+        db.session.add(Appointment(
+            patient_id=patient.id, doctor_id=doctor.id,
+            appointment_date=date.today() + timedelta(days=1), appointment_time=time(9), status='Booked'
+        ))
+        db.session.commit()
+        doctor_headers = auth_headers(doctor.user)
+        patient_headers = auth_headers(patient.user)
+        engine = db.engine
+
+    def dashboard():
+        statements = []
+        record = lambda *args: statements.append(args[2])
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = client.get('/api/doctor/dashboard', headers=doctor_headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        assert response.status_code == 200
+        return response.get_json(), len(statements)
+
+    first, _ = dashboard()
+    assert [apt['patient_name'] for apt in first['upcoming_appointments']] == ['Cachedpat']
+
+    # A new registration leaves the dashboard cached: only the token user lookup runs
+    response = client.post('/api/register', json={
+        'username': 'newcomer', 'email': 'newcomer@test.com', 'password': 'secret123'
+    })
+    assert response.status_code == 201
+    assert dashboard() == (first, 1)
+
+    # A profile edit by one of the doctor's patients invalidates it
+    response = client.put('/api/patient/profile', headers=patient_headers, json={'full_name': 'Renamed'})
+    assert response.status_code == 200
+    updated, _ = dashboard()
+    assert [apt['patient_name'] for apt in updated['upcoming_appointments']] == ['Renamed']
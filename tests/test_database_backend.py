@@ -0,0 +1,37 @@
+from datetime import date
+
+from sqlalchemy import text
+
+from conftest import USING_SQLITE
+from models import db
+from stats import apply_counters, get_counters, rebuild_counters, booking_deltas, appointments_on, APPOINTMENTS, PATIENTS
+
+
+def test_engine_is_configured_for_the_backend(app):
+    with app.app_context():
+        if USING_SQLITE:
+            assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert db.session.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert db.session.execute(text('PRAGMA busy_timeout')).scalar() == 30000
+        else:
+            assert db.engine.pool.size() == app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size']
+            assert db.engine.pool._pre_ping
+
+
+def test_counter_upserts_and_rebuild(app):
+    day = date(2030, 1, 7)
+
+    with app.app_context():
+        # First call inserts the rows, the second takes the ON CONFLICT update path
+        apply_counters(booking_deltas(day, 1))
+        apply_counters(booking_deltas(day, 1))
+        apply_counters({PATIENTS: 1})
+
+        counters = get_counters(APPOINTMENTS, appointments_on(day), PATIENTS)
+        assert counters == {APPOINTMENTS: 2, appointments_on(day): 2, PATIENTS: 1}
+
+        # Nothing in the source tables backs these, so the locked rebuild resets them
+        rebuild_counters()
+        assert get_counters(APPOINTMENTS, appointments_on(day), PATIENTS) == {
+            APPOINTMENTS: 0, appointments_on(day): 0, PATIENTS: 0
+        }
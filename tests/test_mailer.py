@@ -0,0 +1,57 @@
+import socket
+
+import pytest
+
+aiosmtpd = pytest.importorskip('aiosmtpd.controller')
+
+import mailer  # noqa: E402
+from mailer import MailTransport, build_message  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RecordingHandler:
+    """Local SMTP stand-in that records each delivered message with its session"""
+
+    def __init__(self):
+        self.deliveries = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.deliveries.append((id(session), envelope.rcpt_tos))
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = aiosmtpd.Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def test_messages_share_one_smtp_session(smtp_server):
+    controller, handler = smtp_server
+    recipients = [f'patient{i}@test.com' for i in range(5)]
+
+    with MailTransport(host=controller.hostname, port=controller.port) as transport:
+        assert all(transport.send(build_message(to, 'Reminder', 'See you today')) for to in recipients)
+
+    assert [rcpt for _, rcpt in handler.deliveries] == [[to] for to in recipients]
+    assert len({session for session, _ in handler.deliveries}) == 1
+
+
+def test_refused_connection_is_retried_then_reported(monkeypatch):
+    monkeypatch.setattr(mailer, 'RETRY_BACKOFF_SECONDS', 0)
+    transport = MailTransport(host='127.0.0.1', port=free_port())
+
+    connects = []
+    connect = transport._connect
+    monkeypatch.setattr(transport, '_connect', lambda: connects.append(1) or connect())
+
+    assert transport.send(build_message('patient@test.com', 'Reminder', 'See you today')) is False
+    assert len(connects) == mailer.SEND_RETRIES
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+from datetime import date, time, timedelta
+
+from sqlalchemy import event
+
+from conftest import auth_headers, create_doctor, create_patient
+from models import db, User, Appointment, Treatment
+
+# (endpoint, role whose token is used)
+LIST_ENDPOINTS = [
+    ('/api/admin/doctors', 'admin'),
+    ('/api/admin/patients', 'admin'),
+    ('/api/admin/appointments', 'admin'),
+    ('/api/doctor/appointments', 'doctor'),
+    ('/api/patient/appointments', 'patient'),
+    ('/api/patient/history', 'patient'),
+]
+
+# Token user lookup, then the single eager-loaded listing query
+STATEMENTS_PER_LIST = 2
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def seed(prefix, doctors, patients, main_doctor, main_patient):
+    """Add doctors and patients with appointments, some completed with treatments"""
+    new_doctors = [create_doctor(f'{prefix}doc{i}', department_id=i % 6 + 1) for i in range(doctors)]
+    new_patients = [create_patient(f'{prefix}pat{i}') for i in range(patients)]
+
+    for i, (doctor, patient) in enumerate(zip(new_doctors + [main_doctor] * patients, [main_patient] * doctors + new_patients)):
+        appointment = Appointment(
+            patient_id=patient.id, doctor_id=doctor.id,
+            appointment_date=date(2030, 1, 1) + timedelta(days=i), appointment_time=time(9),
+            status='Completed' if i % 2 else 'Booked'
+        )
+        db.session.add(appointment)
+        db.session.flush()
+        if i % 2:
+            db.session.add(Treatment(appointment_id=appointment.id, diagnosis='checkup'))
+    db.session.commit()
+
+
+def measure(app, client, headers):
+    with app.app_context():
+        engine = db.engine
+
+    # Requests run outside any pushed app context so each gets its own (and its own user)
+    counts = {}
+    for endpoint, role in LIST_ENDPOINTS:
+        with count_statements(engine) as statements:
+            response = client.get(endpoint, headers=headers[role])
+        assert response.status_code == 200, endpoint
+        counts[endpoint] = len(statements)
+    return counts
+
+
+def test_list_endpoints_issue_a_fixed_number_of_statements(app, client):
+    with app.app_context():
+        doctor = create_doctor('main')
+        patient = create_patient('main')
+        seed('a', 2, 2, doctor, patient)
+        admin = User.query.filter_by(email='admin@hospital.com').one()
+        headers = {
+            'admin': auth_headers(admin),
+            'doctor': auth_headers(doctor.user),
+            'patient': auth_headers(patient.user)
+        }
+
+    # Warm the auth identity caches so only the listing itself is measured
+    measure(app, client, headers)
+    small = measure(app, client, headers)
+
+    with app.app_context():
+        seed('b', 10, 10, db.session.get(type(doctor), doctor.id), db.session.get(type(patient), patient.id))
+    large = measure(app, client, headers)
+
+    for endpoint, _ in LIST_ENDPOINTS:
+        assert small[endpoint] == STATEMENTS_PER_LIST, (endpoint, small[endpoint])
+        assert large[endpoint] == STATEMENTS_PER_LIST, (endpoint, large[endpoint])
@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+from datetime import date, time
+
+import pytest
+from sqlalchemy import event
+
+from conftest import USING_SQLITE, auth_headers, create_doctor, create_patient, add_availability
+from models import db, Appointment
+from scheduling import get_slot_occupancy
+
+DAY = date(2030, 1, 7)
+
+pytestmark = pytest.mark.skipif(not USING_SQLITE, reason='EXPLAIN QUERY PLAN is SQLite syntax')
+
+
+@contextmanager
+def capture_statements(engine):
+    captured = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield captured
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def query_plans(engine, captured, table):
+    """EXPLAIN QUERY PLAN detail lines for each captured statement reading from table"""
+    plans = []
+    with engine.connect() as conn:
+        for statement, parameters in captured:
+            if f'FROM {table}' not in statement:
+                continue
+            rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+            plans.append([row[-1] for row in rows])
+    assert plans, f'no statement read from {table}'
+    return plans
+
+
+def assert_uses_index(plans, table, index):
+    for plan in plans:
+        assert any(index in line for line in plan), plan
+        assert f'SCAN {table}' not in plan, plan
+
+
+def seed(app):
+    with app.app_context():
+        doctor = create_doctor('planner')
+        patient = create_patient('planner')
+        add_availability(doctor, DAY, time(9), time(11), 4)
+        for hour in (9, 10):
+            db.session.add(Appointment(
+                patient_id=patient.id, doctor_id=doctor.id, appointment_date=DAY,
+                appointment_time=time(hour), status='Completed' if hour == 10 else 'Booked'
+            ))
+        db.session.commit()
+        return doctor.id, auth_headers(doctor.user), auth_headers(patient.user), db.engine
+
+
+def test_slot_occupancy_uses_composite_indexes(app):
+    doctor_id, _, _, engine = seed(app)
+
+    with app.app_context(), capture_statements(engine) as captured:
+        assert get_slot_occupancy(doctor_id, DAY)
+
+    assert_uses_index(query_plans(engine, captured, 'appointment'), 'appointment', 'ix_appointment_doctor_slot')
+    assert_uses_index(query_plans(engine, captured, 'doctor_availability'), 'doctor_availability', 'ix_doctor_availability_lookup')
+
+
+def test_doctor_schedule_uses_doctor_slot_index(app, client):
+    _, doctor_headers, _, engine = seed(app)
+
+    with capture_statements(engine) as captured:
+        assert client.get('/api/doctor/appointments', headers=doctor_headers).status_code == 200
+
+    assert_uses_index(query_plans(engine, captured, 'appointment'), 'appointment', 'ix_appointment_doctor_slot')
+
+
+def test_patient_history_uses_patient_status_index(app, client):
+    _, _, patient_headers, engine = seed(app)
+
+    with capture_statements(engine) as captured:
+        assert client.get('/api/patient/history', headers=patient_headers).status_code == 200
+
+    assert_uses_index(query_plans(engine, captured, 'appointment'), 'appointment', 'ix_appointment_patient_status')
@@ -0,0 +1,49 @@
+import threading
+from datetime import date, time
+
+from conftest import auth_headers, create_doctor, create_patient, add_availability
+from models import db, Appointment
+from stats import APPOINTMENTS, appointments_on, appointments_with_status, get_counters, rebuild_counters
+
+THREADS = 12
+SLOT_DATE = date(2030, 2, 4)
+
+
+def test_counters_match_source_rows_when_bookings_race_reconcile(app):
+    with app.app_context():
+        doctor = create_doctor('counted')
+        add_availability(doctor, SLOT_DATE, time(9), time(10), THREADS)
+        patients = [create_patient(f'counted{i}') for i in range(THREADS)]
+        db.session.commit()
+        rebuild_counters()
+        doctor_id = doctor.id
+        headers = [auth_headers(patient.user) for patient in patients]
+
+    barrier = threading.Barrier(THREADS + 1)
+    statuses = []
+
+    def book(request_headers):
+        client = app.test_client()
+        barrier.wait()
+        response = client.post('/api/patient/appointment/book', headers=request_headers, json={
+            'doctor_id': doctor_id, 'date': SLOT_DATE.isoformat(), 'time': '09:00'
+        })
+        statuses.append(response.status_code)
+
+    def reconcile():
+        with app.app_context():
+            barrier.wait()
+            rebuild_counters()
+
+    threads = [threading.Thread(target=book, args=(h,)) for h in headers]
+    threads.append(threading.Thread(target=reconcile))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [201] * THREADS
+
+    with app.app_context():
+        keys = (APPOINTMENTS, appointments_on(SLOT_DATE), appointments_with_status('Booked'))
+        assert get_counters(*keys) == dict.fromkeys(keys, Appointment.query.count())
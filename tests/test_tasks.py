@@ -0,0 +1,66 @@
+import os
+from datetime import date, time
+
+from conftest import create_doctor, create_patient
+from models import db, Appointment, Treatment
+import exports
+import task
+
+
+def test_send_doctor_report_renders_seeded_appointments(app, monkeypatch):
+    sent = []
+    monkeypatch.setattr(task, 'send_email', lambda to, subject, body: sent.append((to, subject, body)) or True)
+
+    with app.app_context():
+        doctor = create_doctor('report')
+        patient = create_patient('reportpat')
+        appointment = Appointment(
+            patient_id=patient.id, doctor_id=doctor.id,
+            appointment_date=date(2030, 1, 15), appointment_time=time(9), status='Completed'
+        )
+        db.session.add(appointment)
+        db.session.flush()
+        db.session.add(Treatment(appointment_id=appointment.id, diagnosis='seasonal flu'))
+        db.session.commit()
+
+        report = {
+            'doctor_id': doctor.id, 'doctor_name': 'Dr report', 'email': 'dr_report@test.com',
+            'total': 1, 'completed': 1, 'cancelled': 0,
+            'start': '2030-01-01', 'end': '2030-01-31'
+        }
+        assert task.send_doctor_report(report) is True
+
+    [(to, subject, body)] = sent
+    assert to == 'dr_report@test.com'
+    assert subject == 'Monthly Report - January 2030'
+    assert 'Reportpat' in body
+    assert 'seasonal flu' in body
+
+
+def test_export_keeps_both_formats_of_the_current_version(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(exports, 'EXPORT_DIR', str(tmp_path))
+    monkeypatch.setattr(task, 'send_email', lambda *args, **kwargs: True)
+
+    with app.app_context():
+        doctor = create_doctor('export')
+        patient = create_patient('exportpat')
+
+        def complete_appointment(day):
+            db.session.add(Appointment(
+                patient_id=patient.id, doctor_id=doctor.id,
+                appointment_date=day, appointment_time=time(9), status='Completed'
+            ))
+            db.session.commit()
+
+        complete_appointment(date(2030, 1, 15))
+        plain = task.export_treatment_csv(patient.id)
+        compressed = task.export_treatment_csv(patient.id, compress=True)
+        assert sorted(os.listdir(tmp_path)) == sorted([plain['filename'], compressed['filename']])
+
+        again = task.export_treatment_csv(patient.id)
+        assert again['filename'] == plain['filename']
+        assert again['message'] == 'CSV export already up to date'
+
+        complete_appointment(date(2030, 1, 16))
+        newer = task.export_treatment_csv(patient.id, compress=True)
+        assert os.listdir(tmp_path) == [newer['filename']]